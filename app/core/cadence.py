@@ -0,0 +1,158 @@
+import json
+import logging
+import math
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Posts per Reddit listing page
+PAGE_SIZE = 100
+
+def subreddit_of(post_url: str) -> Optional[str]:
+    """Lowercased subreddit from a Reddit permalink (its case can differ from SUBREDDITS)."""
+    match = re.search(r"reddit\.com/r/([^/]+)/", post_url or "")
+    return match.group(1).lower() if match else None
+
+def ewma(previous: Optional[float], value: float, alpha: float) -> float:
+    return value if previous is None else alpha * value + (1 - alpha) * previous
+
+class CadencePlanner:
+    """
+    Decides when each subreddit (and each other source) is due for a poll.
+
+    Per subreddit it keeps an EWMA of the new-post rate (posts/hour) and of
+    the yield (saved leads per new post). A subreddit is polled once it has
+    had time to fill CADENCE_FILL_RATIO of a full fetch (REDDIT_MAX_PAGES
+    pages), so fast ones are polled before posts fall out of reach and quiet
+    ones are left alone. If those cadences would need more Reddit requests
+    per day than REDDIT_DAILY_REQUEST_BUDGET, the lowest-yield subreddits are
+    slowed down first. Non-Reddit sources poll on a fixed interval.
+    State is persisted to DATA_DIR/cadence.json.
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.subreddits: Dict[str, dict] = {}
+        self.sources: Dict[str, float] = {}  # source -> last poll
+        self._load()
+        self.plan()
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+            self.subreddits = state.get("subreddits", {})
+            self.sources = state.get("sources", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error loading polling cadence, starting fresh: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"subreddits": self.subreddits, "sources": self.sources}, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error saving polling cadence: {e}")
+
+    def _state(self, subreddit: str) -> dict:
+        return self.subreddits.setdefault(
+            subreddit, {"rate": None, "yield": None, "last_poll": None, "interval_h": None}
+        )
+
+    @staticmethod
+    def _requests_per_day(rate: float, interval_h: float) -> float:
+        # Pages per poll (capped, past that posts are missed) times polls per day
+        pages = min(settings.REDDIT_MAX_PAGES, max(1, math.ceil(rate * interval_h / PAGE_SIZE)))
+        return pages * 24 / interval_h
+
+    def plan(self):
+        """Recompute every subreddit's interval from its rate, then fit them into the request budget."""
+        low, high = settings.CADENCE_MIN_HOURS, settings.CADENCE_MAX_HOURS
+        target_posts = settings.CADENCE_FILL_RATIO * settings.REDDIT_MAX_PAGES * PAGE_SIZE
+
+        known = []
+        for subreddit in settings.SUBREDDITS:
+            state = self._state(subreddit)
+            if state["rate"] is None:
+                state["interval_h"] = None  # never measured: due right away
+                continue
+            state["interval_h"] = min(high, max(low, target_posts / max(state["rate"], 1e-6)))
+            known.append(subreddit)
+
+        budget = settings.REDDIT_DAILY_REQUEST_BUDGET
+        if not budget:
+            return
+        total = sum(self._requests_per_day(self.subreddits[s]["rate"], self.subreddits[s]["interval_h"]) for s in known)
+        # Least valuable first: slow them down to the max interval until we fit
+        for subreddit in sorted(known, key=lambda s: (self.subreddits[s]["yield"] or 0, -self.subreddits[s]["rate"])):
+            if total <= budget:
+                break
+            state = self.subreddits[subreddit]
+            total -= self._requests_per_day(state["rate"], state["interval_h"])
+            state["interval_h"] = high
+            total += self._requests_per_day(state["rate"], high)
+        if total > budget:
+            logger.warning(f"Polling cadence needs ~{total:.0f} Reddit requests/day even at the max interval (budget {budget})")
+
+    def due_subreddits(self, now: Optional[float] = None) -> List[str]:
+        now = now if now is not None else time.time()
+        due = []
+        for subreddit in settings.SUBREDDITS:
+            state = self._state(subreddit)
+            if state["last_poll"] is None or state["interval_h"] is None:
+                due.append(subreddit)
+            elif now >= state["last_poll"] + state["interval_h"] * 3600:
+                due.append(subreddit)
+        return due
+
+    def due_sources(self, sources: List[str], now: Optional[float] = None) -> List[str]:
+        """Non-Reddit sources, on a fixed CADENCE_SOURCE_HOURS interval."""
+        now = now if now is not None else time.time()
+        return [
+            source for source in sources
+            if now >= (self.sources.get(source) or 0) + settings.CADENCE_SOURCE_HOURS * 3600
+        ]
+
+    def record_source(self, source: str, now: Optional[float] = None):
+        self.sources[source] = now if now is not None else time.time()
+
+    def record_polls(self, polls: Dict[str, Tuple[int, Optional[float]]], saved: Dict[str, int], now: Optional[float] = None):
+        """
+        `polls`: subreddit -> (new posts, hours they span, None if unknown),
+        `saved`: lowercased subreddit -> leads saved from those posts.
+        """
+        now = now if now is not None else time.time()
+        alpha = settings.CADENCE_EWMA_ALPHA
+        for subreddit, (posts, hours) in polls.items():
+            state = self._state(subreddit)
+            if hours:
+                state["rate"] = ewma(state["rate"], posts / hours, alpha)
+            if posts:
+                state["yield"] = ewma(state["yield"], saved.get(subreddit.lower(), 0) / posts, alpha)
+            state["last_poll"] = now
+        self.plan()
+
+    def stats(self) -> dict:
+        return {
+            subreddit: {
+                "posts_per_hour": round(state["rate"], 2) if state["rate"] is not None else None,
+                "yield": round(state["yield"], 4) if state["yield"] is not None else None,
+                "interval_h": round(state["interval_h"], 2) if state["interval_h"] is not None else None,
+                "last_poll": state["last_poll"],
+            }
+            for subreddit, state in self.subreddits.items()
+            if subreddit in settings.SUBREDDITS
+        }
+
+def open_cadence_planner() -> CadencePlanner:
+    return CadencePlanner(os.path.join(settings.DATA_DIR, "cadence.json"))
@@ -1,15 +1,33 @@
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import ValidationError
 
 class Settings(BaseSettings):
     # Gemini
     GEMINI_API_KEY: str
+    GEMINI_MAX_CONCURRENCY: int = 4
+    GEMINI_REQUESTS_PER_MINUTE: float = 15  # Free tier limit for gemini-1.5-flash
+    GEMINI_MAX_RETRIES: int = 5  # Retries after 429 / quota errors
+    GEMINI_BATCH_SIZE: int = 10  # Leads classified per request, 1 disables batching
+    GEMINI_BATCH_ATTEMPTS: int = 2  # Tries of a failed batch request before its leads are deferred
+    GEMINI_LIST_MODELS: bool = False  # Log available models once per process (network call)
+    GEMINI_ANALYSIS_MODE: Literal["two_call", "fused"] = "two_call"  # "fused" drafts qualifying leads in the analysis call
+    GEMINI_DAILY_REQUEST_BUDGET: int = 1500  # Free tier requests per day for gemini-1.5-flash, 0 = unlimited
+    GEMINI_DAILY_TOKEN_BUDGET: int = 0  # 0 = unlimited
+    GEMINI_CYCLE_REQUEST_BUDGET: int = 0  # Per discovery cycle, 0 = unlimited
+    GEMINI_CYCLE_TOKEN_BUDGET: int = 0  # Per discovery cycle, 0 = unlimited
+    LLM_BACKLOG_MAX_AGE_HOURS: float = 72  # Leads deferred by the budget are dropped after this
 
     # Reddit (Read-only mode - no credentials needed)
     REDDIT_CLIENT_ID: Optional[str] = None  # Not needed for read-only access
     REDDIT_CLIENT_SECRET: Optional[str] = None  # Not needed for read-only access
     REDDIT_USER_AGENT: str = "OpsPilotLeadMCP/1.0 (Read-only)"
+    REDDIT_REQUESTS_PER_SECOND: float = 1.0  # Upper bound, tightened by x-ratelimit-* headers
+    REDDIT_MAX_RETRIES: int = 2  # Retries after a 429
+    REDDIT_INCREMENTAL: bool = True  # Only fetch posts newer than the persisted per-subreddit cursor
+    REDDIT_MAX_PAGES: int = 10  # Safety cap on pages per subreddit (or multireddit) per cycle
+    REDDIT_MULTIREDDIT_SIZE: int = 10  # Subreddits combined into one /r/a+b+c listing, 0 or 1 disables
+    REDDIT_DAILY_REQUEST_BUDGET: int = 2000  # Listing requests/day the adaptive cadence may plan for, 0 = unlimited
 
     # LinkedIn (Optional)
     LINKEDIN_USERNAME: Optional[str] = None
@@ -19,12 +37,22 @@ class Settings(BaseSettings):
     TWITTER_USERNAME: Optional[str] = None
     TWITTER_EMAIL: Optional[str] = None
     TWITTER_PASSWORD: Optional[str] = None
+    TWITTER_REQUESTS_PER_MINUTE: float = 3  # Search allows ~50 requests / 15 min per account
+    TWITTER_MAX_RETRIES: int = 2  # Retries after a 429, each waits for x-rate-limit-reset
+    TWITTER_KEYWORDS_PER_QUERY: int = 5  # Keywords OR'd together in one search query
+    TWITTER_MAX_CONCURRENT_QUERIES: int = 2  # Keyword queries paginated in parallel
     
     # Google Sheets
     GOOGLE_SERVICE_ACCOUNT_JSON: str
     SPREADSHEET_NAME: str = "OpsPilot Leads"
+    SHEETS_BATCH_SIZE: int = 50  # Rows per append_rows call
+    SHEETS_FLUSH_INTERVAL_SECONDS: float = 10.0
+    SHEETS_MAX_RETRIES: int = 4
+    DEDUP_FULL_RESCAN: bool = False  # Ignore the persisted key set and re-read the whole sheet
+    SHEETS_STATUS_SYNC_MINUTES: int = 240  # Read lead_status edits back into the lead store (every row, so not every cycle), 0 = never
 
     # Target Configuration
+    SOURCES: List[str] = ["reddit", "linkedin"]  # "twitter" is available but disabled by request
     SUBREDDITS: List[str] = [
         "askmanagers",
         "projectmanagement",
@@ -37,6 +65,45 @@ class Settings(BaseSettings):
         "excel", "sheet", "manual", "chasing", "automation",
         "ops", "operations", "dashboard"
     ]
+    KEYWORD_WEIGHTS: Dict[str, float] = {}  # Keywords not listed weigh 1.0
+    MIN_RELEVANCE_SCORE: float = 1.0  # Leads scoring below this never reach Gemini
+    MIN_URGENCY_SCORE: int = 6  # Leads below this are not drafted or saved
+
+    # Local state (caches, indexes)
+    DATA_DIR: str = "data"
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_TTL_HOURS: float = 24 * 30
+    LLM_CACHE_MAX_ENTRIES: int = 50000
+    NEAR_DUP_ENABLED: bool = True
+    NEAR_DUP_MAX_DISTANCE: int = 3  # SimHash bits; also sets the number of LSH bands (distance + 1)
+    NEAR_DUP_MAX_ENTRIES: int = 200000
+
+    # Workflow
+    SOURCE_FETCH_TIMEOUT_SECONDS: float = 120.0
+    PIPELINE_QUEUE_SIZE: int = 100  # Max leads waiting between two stages
+    PIPELINE_PRIORITY_QUEUE_SIZE: int = 5000  # Max leads waiting for analysis, ordered by pre-score
+    PIPELINE_BATCH_QUEUE_SIZE: int = 8  # Max LeadBatches (one per subreddit fetch) waiting for prefilter / dedup
+    PIPELINE_ANALYZE_WORKERS: int = 4
+    PIPELINE_DRAFT_WORKERS: int = 4
+    RUN_HISTORY_SIZE: int = 50  # Finished runs kept for /runs
+    LEADER_LEASE_SECONDS: float = 60.0  # Scheduler / cycle lease lifetime without a heartbeat (takeover delay)
+    LEADER_HEARTBEAT_SECONDS: float = 15.0
+
+    # Tracing (per-lead stage spans, /runs/{id}/trace)
+    TRACING_ENABLED: bool = False
+    TRACE_RING_SIZE: int = 50000  # Spans kept in memory across runs
+    TRACE_JSONL: bool = False  # Also append spans to DATA_DIR/traces/spans.jsonl
+    TRACE_JSONL_MAX_BYTES: int = 10_000_000  # Rotate the JSONL file at this size
+    TRACE_JSONL_BACKUPS: int = 3
+
+    # Adaptive polling cadence
+    ADAPTIVE_SCHEDULING: bool = True  # False = one full cycle every 24h
+    SCHEDULER_TICK_MINUTES: float = 15.0  # How often the leader checks which subreddits / sources are due
+    CADENCE_MIN_HOURS: float = 0.5
+    CADENCE_MAX_HOURS: float = 24.0
+    CADENCE_FILL_RATIO: float = 0.5  # Poll once a subreddit has filled this share of REDDIT_MAX_PAGES pages
+    CADENCE_EWMA_ALPHA: float = 0.3  # Weight of the latest post-rate / yield observation
+    CADENCE_SOURCE_HOURS: float = 24.0  # Fixed interval for LinkedIn / X
 
     model_config = SettingsConfigDict(
         env_file=".env", 
@@ -0,0 +1,54 @@
+import re
+from array import array
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+from app.core.config import settings
+
+# Common inflections, so "report" still matches "reports"/"reporting" while
+# the leading word boundary stops "team" matching "steam" or "ops" matching "stops".
+SUFFIXES = r"(?:s|es|d|ed|ing|r|rs|er|ers|ment|ments)?"
+
+class KeywordMatch(NamedTuple):
+    score: float
+    terms: List[str]
+
+class KeywordMatcher:
+    """
+    Single compiled, word-bounded regex over every configured keyword.
+    Scores a text by the summed weight of the distinct keywords it contains.
+    """
+    def __init__(self, keywords: Sequence[str], weights: Dict[str, float] = None):
+        weights = {k.lower(): w for k, w in (weights or {}).items()}
+        self.weights = {k.lower(): weights.get(k.lower(), 1.0) for k in keywords}
+        # Longest first so overlapping keywords prefer the more specific term
+        alternatives = sorted(self.weights, key=len, reverse=True)
+        self.pattern = re.compile(
+            rf"\b({'|'.join(re.escape(k) for k in alternatives)}){SUFFIXES}\b",
+            re.IGNORECASE
+        ) if alternatives else None
+
+    def match(self, text: str) -> KeywordMatch:
+        if not self.pattern or not text:
+            return KeywordMatch(0.0, [])
+        terms = list(dict.fromkeys(m.group(1).lower() for m in self.pattern.finditer(text)))
+        return KeywordMatch(sum((self.weights[t] for t in terms), 0.0), terms)
+
+    def score_many(self, texts: Sequence[str]) -> Tuple[array, List[List[str]]]:
+        """Scores and matched terms for a whole column of texts (LeadBatch.post_excerpt)."""
+        scores, matched = array("d"), []
+        if not self.pattern:
+            return array("d", [0.0]) * len(texts), [[] for _ in texts]
+        findall, weights = self.pattern.findall, self.weights
+        for text in texts:
+            terms = list(dict.fromkeys(t.lower() for t in findall(text))) if text else []
+            scores.append(sum((weights[t] for t in terms), 0.0))
+            matched.append(terms)
+        return scores, matched
+
+@lru_cache(maxsize=4)
+def _build_matcher(keywords: Tuple[str, ...], weights: Tuple[Tuple[str, float], ...]) -> KeywordMatcher:
+    return KeywordMatcher(keywords, dict(weights))
+
+def get_matcher() -> KeywordMatcher:
+    """Matcher for the current settings, compiled once per keyword configuration."""
+    return _build_matcher(tuple(settings.KEYWORDS), tuple(sorted(settings.KEYWORD_WEIGHTS.items())))
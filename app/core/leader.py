@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Optional
+from app.core.config import settings
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+# Identifies this worker process in lease rows (and /health)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def lease_path() -> str:
+    return os.path.join(settings.DATA_DIR, "leases.sqlite3")
+
+class Lease:
+    """
+    Named lease row in a SQLite file shared by the uvicorn workers of one
+    host (same DATA_DIR). Whoever holds an unexpired row owns the lease; the
+    holder keeps it by calling acquire() again before it expires, and anyone
+    may take it over once it has.
+    """
+    def __init__(self, path: str, name: str, ttl: float, holder: str = WORKER_ID):
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # isolation_level=None: explicit BEGIN IMMEDIATE, so check-and-take is atomic across processes.
+        # Default rollback journal: switching to WAL isn't covered by the busy timeout when workers start together.
+        self.conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                acquired_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+
+    def acquire(self) -> bool:
+        """Take the lease if it is free or expired, or renew it if we hold it."""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            taken = self.conn.execute("""
+                INSERT INTO leases (name, holder, acquired_at, expires_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    acquired_at = CASE WHEN leases.holder = excluded.holder THEN leases.acquired_at ELSE excluded.acquired_at END,
+                    holder = excluded.holder,
+                    expires_at = excluded.expires_at
+                WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+            """, (self.name, self.holder, now, now + self.ttl, now)).rowcount
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return taken > 0
+
+    def release(self):
+        self.conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder))
+
+    def current_holder(self) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT holder FROM leases WHERE name = ? AND expires_at >= ?", (self.name, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    async def keep_alive(self, interval: float):
+        """Renew until cancelled (run as a task next to the work the lease protects)."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if not self.acquire():
+                    logger.error(f"Lost lease {self.name} to {self.current_holder()}")
+                    return
+            except Exception as e:
+                logger.error(f"Failed to renew lease {self.name}: {e}")
+
+    def close(self):
+        self.conn.close()
+
+class LeaderElection:
+    """
+    Keeps trying for the scheduler lease on a heartbeat. Exactly one worker
+    is leader at a time; if it dies, another one takes over once the lease
+    expires (LEADER_LEASE_SECONDS).
+    """
+    def __init__(self, lease: Lease, heartbeat: float):
+        self.lease = lease
+        self.heartbeat = heartbeat
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def beat(self):
+        try:
+            leader = self.lease.acquire()
+        except Exception as e:
+            # Can't tell, so assume the worst: better no scheduled cycle than two
+            logger.error(f"Scheduler lease heartbeat failed: {e}")
+            leader = False
+        if leader != self.is_leader:
+            if leader:
+                logger.info(f"Worker {self.lease.holder} is now the scheduler leader")
+            else:
+                logger.info(f"Worker {self.lease.holder} is no longer the scheduler leader (holder: {self.lease.current_holder()})")
+        self.is_leader = leader
+        metrics.SCHEDULER_LEADER.set(1 if leader else 0)
+
+    async def _run(self):
+        while True:
+            self.beat()
+            await asyncio.sleep(self.heartbeat)
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+        if self.is_leader:
+            # Hand over right away instead of waiting for the lease to expire
+            self.lease.release()
+            self.is_leader = False
+            metrics.SCHEDULER_LEADER.set(0)
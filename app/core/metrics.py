@@ -0,0 +1,204 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+# Seconds. Covers fast local lookups up to slow LLM / scraping calls.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500)
+
+LabelKey = Tuple[str, ...]
+
+def _format_labels(names: Sequence[str], values: LabelKey, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: LabelKey) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self.values.items()]
+
+    def to_dict(self) -> list:
+        return [{"labels": self._labels(key), "value": value} for key, value in self.values.items()]
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts..., +Inf count], sum, count
+        self.values: Dict[LabelKey, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        counts = entry[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def quantile(self, q: float, key: LabelKey) -> float:
+        """Bucket-interpolated estimate, same approach as PromQL histogram_quantile."""
+        counts, _, total = self.values[key]
+        rank = q * total
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, counts):
+            if count and cumulative + count >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, total_sum, total_count) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {total_count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total_sum}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {total_count}")
+        return lines
+
+    def to_dict(self) -> list:
+        return [
+            {
+                "labels": self._labels(key),
+                "count": total_count,
+                "sum": round(total_sum, 6),
+                "avg": round(total_sum / total_count, 6) if total_count else 0.0,
+                "p50": round(self.quantile(0.5, key), 6),
+                "p95": round(self.quantile(0.95, key), 6),
+            }
+            for key, (_, total_sum, total_count) in self.values.items()
+        ]
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        return {
+            name: {"type": metric.type, "help": metric.help, "values": metric.to_dict()}
+            for name, metric in self.metrics.items()
+        }
+
+registry = MetricsRegistry()
+
+# Ingest
+SOURCE_POSTS = registry.counter("opspilot_source_leads_fetched_total", "Leads returned by each source", ["source"])
+SOURCE_ERRORS = registry.counter("opspilot_source_errors_total", "Failed or timed out source fetches", ["source"])
+SOURCE_FETCH_SECONDS = registry.histogram("opspilot_source_fetch_seconds", "Source fetch latency", ["source"])
+
+# Dedup
+DEDUP_CHECKS = registry.counter("opspilot_dedup_checks_total", "Dedup lookups by result (hit = duplicate)", ["result"])
+NEAR_DUP_CHECKS = registry.counter("opspilot_near_dup_checks_total", "SimHash near-duplicate lookups by result", ["result"])
+NEAR_DUP_ENTRIES = registry.gauge("opspilot_near_dup_entries", "Fingerprints held by the near-duplicate index")
+NEAR_DUP_MEMORY_BYTES = registry.gauge("opspilot_near_dup_memory_bytes", "Approximate memory used by the near-duplicate index")
+NEAR_DUP_COLLISION_RATE = registry.gauge("opspilot_near_dup_collision_rate", "Share of LSH bucket candidates that were not near-duplicates")
+
+# Gemini
+GEMINI_REQUEST_SECONDS = registry.histogram("opspilot_gemini_request_seconds", "Gemini call latency", ["outcome"])
+GEMINI_ERRORS = registry.counter("opspilot_gemini_errors_total", "Gemini call errors by exception type", ["error"])
+GEMINI_QUOTA_ERRORS = registry.counter("opspilot_gemini_quota_errors_total", "Gemini 429 / quota exhausted responses")
+GEMINI_BUDGET_USED = registry.gauge("opspilot_gemini_budget_used", "Gemini requests / tokens used in the current cycle or day", ["window", "unit"])
+LLM_DEFERRED = registry.counter("opspilot_llm_deferred_leads_total", "Leads carried over to the next cycle because the Gemini budget ran out", ["stage"])
+LLM_CACHE_LOOKUPS = registry.counter("opspilot_llm_cache_lookups_total", "LLM result cache lookups", ["result"])
+
+# Sheets
+SHEETS_WRITE_SECONDS = registry.histogram("opspilot_sheets_write_seconds", "Google Sheets append_rows latency", ["outcome"])
+SHEETS_BATCH_ROWS = registry.histogram("opspilot_sheets_batch_rows", "Rows per Google Sheets write", buckets=SIZE_BUCKETS)
+
+# Providers
+PROVIDER_INIT_SECONDS = registry.histogram("opspilot_provider_init_seconds", "Time to import and construct a provider (once per process)", ["provider"])
+
+# Pipeline
+STAGE_SECONDS = registry.histogram("opspilot_stage_seconds", "Pipeline stage handler latency per item or batch", ["stage"])
+
+# Cycle
+CYCLE_SECONDS = registry.histogram("opspilot_cycle_seconds", "Discovery cycle duration")
+CYCLE_LEADS = registry.counter("opspilot_cycle_leads_total", "Leads by cycle outcome", ["outcome"])
+LAST_CYCLE_TIMESTAMP = registry.gauge("opspilot_last_cycle_timestamp_seconds", "Unix time the last cycle finished")
+
+def ratio(counter: Counter, hit_labels: dict, miss_labels: dict) -> float:
+    hits = counter.get(**hit_labels)
+    total = hits + counter.get(**miss_labels)
+    return round(hits / total, 4) if total else 0.0
+
+# Scheduler
+SCHEDULER_LEADER = registry.gauge("opspilot_scheduler_leader", "1 if this worker holds the scheduler lease")
+RUNS_SKIPPED = registry.counter("opspilot_runs_skipped_total", "Runs not started because another worker was running a cycle")
@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import os
+import re
+import sys
+from array import array
+from collections import deque
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_BITS = 64
+SHINGLE_SIZE = 3
+
+def _tokens(text: str) -> List[str]:
+    text = re.sub(r"https?://\S+", " ", (text or "").lower())
+    return re.findall(r"[a-z0-9']+", text)
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over word 3-gram shingles. Similar texts differ in few bits."""
+    tokens = _tokens(text)
+    if len(tokens) >= SHINGLE_SIZE:
+        shingles = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+    else:
+        shingles = set(tokens)
+    if not shingles:
+        return 0
+
+    # Bit-column counting on binary strings keeps the per-bit loop in C
+    hashes = [
+        format(int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big"), "064b")
+        for s in shingles
+    ]
+    half = len(hashes) / 2
+    bits = "".join("1" if column.count("1") > half else "0" for column in zip(*hashes))
+    return int(bits, 2)
+
+class NearDuplicateIndex:
+    """
+    Persistent SimHash index with LSH banding. The fingerprint is split into
+    max_distance + 1 bands, so any two fingerprints within max_distance bits
+    share at least one identical band (pigeonhole) and a lookup only compares
+    against the few fingerprints in those band buckets.
+    """
+    def __init__(self, path: Optional[str] = None, max_distance: int = 3, max_entries: int = 200000):
+        self.path = path
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.num_bands = max_distance + 1
+        self.band_bits = FINGERPRINT_BITS // self.num_bands
+        self.band_mask = (1 << self.band_bits) - 1
+
+        self.buckets: List[Dict[int, List[int]]] = [{} for _ in range(self.num_bands)]
+        self.order: deque = deque()  # insertion order, for FIFO eviction
+
+        self.lookups = 0
+        self.hits = 0
+        self.candidates_compared = 0
+        self.collisions = 0  # shared a band bucket but were too far apart
+
+        self.file_mtime: Optional[int] = None  # of the file as we last loaded / saved it
+        if path:
+            self.load()
+
+    def _bands(self, fingerprint: int):
+        for band in range(self.num_bands):
+            yield band, (fingerprint >> (band * self.band_bits)) & self.band_mask
+
+    def find(self, fingerprint: int) -> Optional[int]:
+        """Return a stored fingerprint within max_distance bits, if any."""
+        seen = set()
+        for band, key in self._bands(fingerprint):
+            for candidate in self.buckets[band].get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                self.candidates_compared += 1
+                if (candidate ^ fingerprint).bit_count() <= self.max_distance:
+                    return candidate
+                self.collisions += 1
+        return None
+
+    def add(self, fingerprint: int):
+        for band, key in self._bands(fingerprint):
+            self.buckets[band].setdefault(key, []).append(fingerprint)
+        self.order.append(fingerprint)
+        while len(self.order) > self.max_entries:
+            self._remove(self.order.popleft())
+
+    def _remove(self, fingerprint: int):
+        for band, key in self._bands(fingerprint):
+            bucket = self.buckets[band].get(key)
+            if bucket:
+                bucket.remove(fingerprint)
+                if not bucket:
+                    del self.buckets[band][key]
+
+    def check_and_add(self, text: str) -> bool:
+        """True if `text` is a near-duplicate of something already indexed."""
+        fingerprint = simhash(text)
+        if not fingerprint:
+            return False
+
+        self.lookups += 1
+        if self.find(fingerprint) is not None:
+            self.hits += 1
+            return True
+        self.add(fingerprint)
+        return False
+
+    def _mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            fingerprints = array("Q")
+            with open(self.path, "rb") as f:
+                fingerprints.frombytes(f.read())
+            for fingerprint in fingerprints:
+                self.add(fingerprint)
+            self.file_mtime = self._mtime()
+            logger.info(f"Loaded {len(self.order)} near-duplicate fingerprints")
+        except Exception as e:
+            logger.error(f"Error loading near-duplicate index, starting empty: {e}")
+
+    def refresh(self):
+        """Re-read the file only if someone else (another worker) saved it since we last loaded or saved it."""
+        if not self.path or self._mtime() in (None, self.file_mtime):
+            return
+        self.buckets = [{} for _ in range(self.num_bands)]
+        self.order = deque()
+        self.load()
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(array("Q", self.order).tobytes())
+            os.replace(tmp_path, self.path)
+            self.file_mtime = self._mtime()
+        except Exception as e:
+            logger.error(f"Error saving near-duplicate index: {e}")
+
+    def memory_bytes(self) -> int:
+        """Approximate in-memory footprint of the index structures."""
+        total = sys.getsizeof(self.order) + len(self.order) * 32  # deque + int objects
+        for buckets in self.buckets:
+            total += sys.getsizeof(buckets)
+            total += sum(sys.getsizeof(bucket) for bucket in buckets.values())
+        return total
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.order),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "memory_bytes": self.memory_bytes(),
+            "collision_rate": round(self.collisions / self.candidates_compared, 4) if self.candidates_compared else 0.0,
+        }
@@ -0,0 +1,128 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+from app.core import metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+# End-of-stream marker passed down the queues
+DONE = object()
+
+class PriorityQueue(asyncio.Queue):
+    """
+    asyncio.Queue that hands out the item with the highest `key(item)` first
+    (FIFO among ties). DONE always sorts last, so it only comes out once
+    everything queued before it has been taken.
+    """
+    def __init__(self, maxsize: int = 0, key: Callable[[Any], float] = None):
+        self.key = key
+        self._counter = itertools.count()
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self._queue = []
+
+    def _put(self, item):
+        priority = float("inf") if item is DONE else -self.key(item)
+        heapq.heappush(self._queue, (priority, next(self._counter), item))
+
+    def _get(self):
+        return heapq.heappop(self._queue)[2]
+
+class Stage:
+    """
+    A pool of workers connected by bounded asyncio queues.
+    Each worker takes one item (or a list of up to `batch_size` items) from
+    `inbox`, awaits `handler` on it and puts whatever it returns on `outbox`.
+    A full outbox blocks the workers, which is how backpressure travels upstream.
+    `item_size` counts the rows in an item when items are batches themselves
+    (LeadBatch), so progress reports rows rather than queue items.
+    """
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Any], Awaitable[Optional[Iterable[Any]]]],
+        inbox: asyncio.Queue,
+        outbox: Optional[asyncio.Queue] = None,
+        workers: int = 1,
+        batch_size: int = 1,
+        linger: float = 0.2,
+        progress: Optional[Dict[str, Dict[str, int]]] = None,
+        item_size: Optional[Callable[[Any], int]] = None,
+    ):
+        self.name = name
+        self.handler = handler
+        self.inbox = inbox
+        self.outbox = outbox
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.linger = linger
+        self.item_size = item_size
+        self.processed = 0
+        self.errors = 0
+        # Shared dict the stage reports live counters into (e.g. Run.stages)
+        self.progress = progress if progress is not None else {}
+        self._report()
+
+    def _report(self):
+        self.progress[self.name] = {
+            "processed": self.processed,
+            "errors": self.errors,
+            "queued": self.inbox.qsize(),
+        }
+
+    async def run(self):
+        await asyncio.gather(*(self._worker() for _ in range(self.workers)))
+        if self.outbox is not None:
+            await self.outbox.put(DONE)
+
+    async def _next_batch(self, first) -> tuple:
+        """Top up a batch with whatever is queued (after a short linger). Returns (batch, done)."""
+        batch = [first]
+        if self.inbox.qsize() < self.batch_size - 1:
+            await asyncio.sleep(self.linger)
+        while len(batch) < self.batch_size and not self.inbox.empty():
+            item = self.inbox.get_nowait()
+            if item is DONE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _worker(self):
+        while True:
+            item = await self.inbox.get()
+            if item is DONE:
+                # Let sibling workers see the marker too
+                await self.inbox.put(DONE)
+                return
+
+            done = False
+            if self.batch_size > 1:
+                item, done = await self._next_batch(item)
+
+            started = time.perf_counter()
+            try:
+                with tracing.span(self.name, item) as span:
+                    results = await self.handler(item)
+                    span.set_result(results)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Pipeline stage {self.name} failed: {e}")
+                results = None
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage=self.name)
+
+            if self.item_size:
+                self.processed += self.item_size(item)
+            else:
+                self.processed += len(item) if self.batch_size > 1 else 1
+            self._report()
+            if results and self.outbox is not None:
+                for result in results:
+                    await self.outbox.put(result)
+
+            if done:
+                await self.inbox.put(DONE)
+                return
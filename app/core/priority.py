@@ -0,0 +1,24 @@
+import math
+import time
+from typing import Optional
+from app.models.lead import Lead
+
+# Pre-score weights. Keyword relevance is typically 1-3, a fresh post adds up
+# to RECENCY_WEIGHT, and ~200 upvotes add about ENGAGEMENT_WEIGHT * 5.
+RECENCY_WEIGHT = 2.0
+RECENCY_HALF_LIFE_HOURS = 12.0
+ENGAGEMENT_WEIGHT = 0.5
+
+def pre_score(lead: Lead, now: Optional[float] = None) -> float:
+    """
+    Cheap score deciding which leads get Gemini budget first: keyword
+    relevance, plus a freshness bonus that halves every 12h, plus log-scaled
+    engagement (comments count double, they signal a live discussion).
+    """
+    now = now if now is not None else time.time()
+    score = lead.relevance_score
+    if lead.posted_utc:
+        age_hours = max(0.0, now - lead.posted_utc) / 3600
+        score += RECENCY_WEIGHT * 0.5 ** (age_hours / RECENCY_HALF_LIFE_HOURS)
+    score += ENGAGEMENT_WEIGHT * math.log1p(max(0, lead.upvotes) + 2 * max(0, lead.comments))
+    return score
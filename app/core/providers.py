@@ -0,0 +1,84 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List
+from app.core.config import settings
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+# Each factory imports its SDK on first use, so a cold start only pays for
+# google.generativeai / gspread / twikit / linkedin_api once a cycle needs them.
+
+def _reddit():
+    from app.services.reddit import RedditService
+    return RedditService()
+
+def _linkedin():
+    from app.services.linkedin import LinkedinService
+    return LinkedinService()
+
+def _twitter():
+    from app.services.twitter import TwitterService
+    return TwitterService()
+
+def _gemini():
+    from app.services.gemini import GeminiService
+    return GeminiService()
+
+def _lead_store():
+    from app.services.lead_store import open_lead_store
+    return open_lead_store()
+
+def _sheets():
+    from app.services.sheets import SheetsService
+    return SheetsService(get("lead_store"))
+
+def _near_dups():
+    from app.core.near_dup import NearDuplicateIndex
+    return NearDuplicateIndex(
+        os.path.join(settings.DATA_DIR, "near_dup.bin"),
+        max_distance=settings.NEAR_DUP_MAX_DISTANCE,
+        max_entries=settings.NEAR_DUP_MAX_ENTRIES
+    )
+
+FACTORIES: Dict[str, Callable[[], Any]] = {
+    "reddit": _reddit,
+    "linkedin": _linkedin,
+    "twitter": _twitter,
+    "gemini": _gemini,
+    "lead_store": _lead_store,
+    "sheets": _sheets,
+    "near_dups": _near_dups,
+}
+
+# A source is only imported when it is listed in SOURCES and has credentials
+SOURCE_CONFIGURED: Dict[str, Callable[[], bool]] = {
+    "reddit": lambda: True,  # public JSON API
+    "linkedin": lambda: bool(settings.LINKEDIN_USERNAME and settings.LINKEDIN_PASSWORD),
+    "twitter": lambda: bool(settings.TWITTER_USERNAME and settings.TWITTER_PASSWORD),
+}
+
+# Long-lived service instances, shared by every cycle in this process
+instances: Dict[str, Any] = {}
+_lock = threading.RLock()  # sheets is built from a worker thread
+
+def get(name: str) -> Any:
+    """The process-wide instance of a provider, built on first use."""
+    with _lock:
+        if name not in instances:
+            started = time.perf_counter()
+            instances[name] = FACTORIES[name]()
+            elapsed = time.perf_counter() - started
+            metrics.PROVIDER_INIT_SECONDS.observe(elapsed, provider=name)
+            logger.info(f"Loaded provider {name} in {elapsed:.2f}s")
+        return instances[name]
+
+def enabled_sources() -> List[str]:
+    return [name for name in settings.SOURCES if name in SOURCE_CONFIGURED and SOURCE_CONFIGURED[name]()]
+
+def reset():
+    """Forget every instance (tests, benchmark runs with a fresh DATA_DIR)."""
+    with _lock:
+        instances.clear()
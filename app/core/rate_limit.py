@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Non-blocking token bucket for pacing outbound API calls.
+    Waiters sleep on the event loop instead of blocking it, and callers can
+    pause the whole bucket (e.g. on a 429) or retune its rate from server hints.
+    """
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate  # tokens per second
+        self.max_rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        # The lock keeps waiters in FIFO order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Block every acquire() for the next `seconds` without blocking the loop."""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    def set_rate(self, rate: float):
+        """Retune the refill rate, never above the configured maximum."""
+        now = time.monotonic()
+        self._refill(now)
+        self.rate = max(min(rate, self.max_rate), 1e-3)
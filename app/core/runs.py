@@ -0,0 +1,239 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional, Tuple
+from app.core.config import settings
+from app.core import metrics
+from app.core.leader import WORKER_ID, Lease, lease_path
+from app.core.workflow import run_discovery_cycle
+from app.models.run import Run
+
+logger = logging.getLogger(__name__)
+
+class RunStore:
+    """
+    Runs shared by the uvicorn workers of one host, in the same SQLite file
+    as the leases, so /runs and /runs/{id} answer the same on every worker.
+    `triggers` has its own column: other workers append to it when they
+    coalesce into a run, while the owner keeps rewriting the rest.
+    """
+    def __init__(self, path: str):
+        # Same connection settings as Lease: explicit transactions, rollback journal
+        self.conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                worker TEXT,
+                status TEXT NOT NULL,
+                started_at TEXT NOT NULL,
+                triggers TEXT NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_started ON runs (started_at)")
+
+    def save(self, run: Run):
+        """Insert the run, or overwrite its status / progress (not its triggers)."""
+        self.conn.execute("""
+            INSERT INTO runs (run_id, worker, status, started_at, triggers, data) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (run_id) DO UPDATE SET status = excluded.status, data = excluded.data
+        """, (run.run_id, run.worker, run.status, run.started_at, json.dumps(run.triggers), run.model_dump_json()))
+
+    def add_trigger(self, run_id: str, trigger: str) -> List[str]:
+        """Append a coalesced trigger; returns the run's triggers."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT triggers FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            triggers = json.loads(row[0]) + [trigger] if row else [trigger]
+            self.conn.execute("UPDATE runs SET triggers = ? WHERE run_id = ?", (json.dumps(triggers), run_id))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return triggers
+
+    @staticmethod
+    def _to_run(row) -> Run:
+        run = Run.model_validate_json(row[1])
+        run.triggers = json.loads(row[0])
+        return run
+
+    def get(self, run_id: str) -> Optional[Run]:
+        row = self.conn.execute("SELECT triggers, data FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return self._to_run(row) if row else None
+
+    def running(self, worker: str) -> Optional[Run]:
+        """The newest run `worker` still has in flight."""
+        row = self.conn.execute(
+            "SELECT triggers, data FROM runs WHERE worker = ? AND status = 'running' ORDER BY started_at DESC LIMIT 1",
+            (worker,)
+        ).fetchone()
+        return self._to_run(row) if row else None
+
+    def history(self, limit: int) -> List[Run]:
+        rows = self.conn.execute("SELECT triggers, data FROM runs ORDER BY started_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._to_run(row) for row in rows]
+
+    def trim(self, keep: int):
+        self.conn.execute(
+            "DELETE FROM runs WHERE run_id NOT IN (SELECT run_id FROM runs ORDER BY started_at DESC LIMIT ?)", (keep,)
+        )
+
+    def close(self):
+        self.conn.close()
+
+class RunManager:
+    """
+    Owns discovery runs for this process. Concurrent triggers (/run-now, the
+    scheduler) coalesce into the single in-flight run instead of starting a
+    second cycle, and a bounded history of runs is kept for /runs.
+    Across uvicorn workers a cycle lease does the same job: a trigger that
+    arrives while another worker is mid-cycle joins that worker's run, found
+    through the shared RunStore.
+    """
+    def __init__(self, history_size: int = 50, store_path: Optional[str] = None):
+        self.history_size = history_size
+        self.store_path = store_path
+        # Runs started by this process, live objects (the pipeline updates them in place)
+        self.runs: "OrderedDict[str, Run]" = OrderedDict()
+        self.current: Optional[Run] = None
+        self._task: Optional[asyncio.Task] = None
+        self._store: Optional[RunStore] = None
+
+    @property
+    def store(self) -> RunStore:
+        # Opened on first use, DATA_DIR may not exist at import time
+        if self._store is None:
+            self._store = RunStore(self.store_path or lease_path())
+        return self._store
+
+    def _running_elsewhere(self) -> Optional[Run]:
+        """The run of the worker currently holding the cycle lease, if that isn't us."""
+        lease = Lease(lease_path(), "discovery_cycle", settings.LEADER_LEASE_SECONDS)
+        try:
+            holder = lease.current_holder()
+        finally:
+            lease.close()
+        if holder is None or holder == WORKER_ID:
+            return None
+        return self.store.running(holder)
+
+    def trigger(self, trigger: str, sources: Optional[List[str]] = None, subreddits: Optional[List[str]] = None) -> Tuple[Run, bool]:
+        """
+        Start a run, or join the in-flight one. Returns (run, coalesced).
+        `sources` / `subreddits` narrow a new run; a coalesced trigger keeps the in-flight run's scope.
+        """
+        if self.busy():
+            self.current.triggers = self.store.add_trigger(self.current.run_id, trigger)
+            logger.info(f"Trigger '{trigger}' coalesced into in-flight run {self.current.run_id}")
+            return self.current, True
+
+        other = self._running_elsewhere()
+        if other is not None:
+            other.triggers = self.store.add_trigger(other.run_id, trigger)
+            logger.info(f"Trigger '{trigger}' coalesced into run {other.run_id} on worker {other.worker}")
+            return other, True
+
+        run = Run(triggers=[trigger], sources=sources, subreddits=subreddits, worker=WORKER_ID)
+        self.current = run
+        self.runs[run.run_id] = run
+        while len(self.runs) > self.history_size:
+            self.runs.popitem(last=False)
+        self.store.save(run)
+        self.store.trim(self.history_size)
+
+        self._task = asyncio.create_task(self._execute(run))
+        logger.info(f"Started run {run.run_id} (trigger: {trigger})")
+        return run, False
+
+    async def _execute(self, run: Run):
+        started = time.monotonic()
+        lease = None
+        keep_alive = None
+        checkpoint = None
+        try:
+            lease = Lease(lease_path(), "discovery_cycle", settings.LEADER_LEASE_SECONDS)
+            if not lease.acquire():
+                # Lost the race with another worker's trigger between our check and now
+                holder = lease.current_holder()
+                other = self.store.running(holder) if holder else None
+                logger.info(f"Run {run.run_id} skipped: worker {holder} is already running a discovery cycle")
+                run.status = "skipped"
+                run.error = f"Worker {holder} is already running a discovery cycle" + (f" ({other.run_id})" if other else "")
+                metrics.RUNS_SKIPPED.inc()
+                return
+            keep_alive = asyncio.create_task(lease.keep_alive(settings.LEADER_HEARTBEAT_SECONDS))
+            checkpoint = asyncio.create_task(self._checkpoint(run))
+
+            run.result = await run_discovery_cycle(run=run)
+            run.status = "completed"
+        except Exception as e:
+            logger.error(f"Run {run.run_id} failed: {e}")
+            run.status = "failed"
+            run.error = str(e)
+        finally:
+            if checkpoint is not None:
+                checkpoint.cancel()
+            if keep_alive is not None:
+                keep_alive.cancel()
+            # Terminal status first: a run left "running" would absorb every later trigger
+            if run.status == "running":
+                run.status = "failed"
+                run.error = run.error or "Cancelled"
+            run.duration_s = round(time.monotonic() - started, 3)
+            run.finished_at = datetime.utcnow().isoformat()
+            self._save(run)
+            if lease is not None:
+                try:
+                    if keep_alive is not None:
+                        lease.release()
+                except Exception as e:
+                    # Not fatal: the lease expires after LEADER_LEASE_SECONDS
+                    logger.error(f"Run {run.run_id}: failed to release the discovery cycle lease: {e}")
+                finally:
+                    lease.close()
+
+    async def _checkpoint(self, run: Run):
+        """Publish live progress to the other workers, on the lease heartbeat."""
+        while True:
+            await asyncio.sleep(settings.LEADER_HEARTBEAT_SECONDS)
+            self._save(run)
+
+    def _save(self, run: Run):
+        try:
+            self.store.save(run)
+        except Exception as e:
+            logger.error(f"Failed to save run {run.run_id}: {e}")
+
+    async def wait(self, run: Run):
+        """Wait for a run started by this manager to finish."""
+        if self.current is run and self._task is not None:
+            await asyncio.shield(self._task)
+
+    def get(self, run_id: str) -> Optional[Run]:
+        """Our own runs live, other workers' runs as of their last checkpoint."""
+        stored = self.store.get(run_id)
+        run = self.runs.get(run_id)
+        if run is None:
+            return stored
+        if stored is not None:
+            run.triggers = stored.triggers  # may include other workers' triggers
+        return run
+
+    def busy(self) -> bool:
+        return self.current is not None and self.current.status == "running"
+
+    def history(self) -> List[Run]:
+        runs = []
+        for stored in self.store.history(self.history_size):
+            run = self.runs.get(stored.run_id)
+            if run is not None:
+                run.triggers = stored.triggers
+            runs.append(run or stored)
+        return runs
+
+run_manager = RunManager(settings.RUN_HISTORY_SIZE)
@@ -1,13 +1,70 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from app.core.workflow import run_discovery_cycle
+from typing import Optional
+from app.core.config import settings
+from app.core import providers
+from app.core.cadence import open_cadence_planner
+from app.core.leader import Lease, LeaderElection, lease_path
+from app.core.runs import run_manager
 import logging
 
 logger = logging.getLogger(__name__)
 
 scheduler = AsyncIOScheduler()
 
+# Every uvicorn worker registers the job, only the lease holder runs it
+election: Optional[LeaderElection] = None
+
+def _is_leader() -> bool:
+    # Re-check at fire time, the flag may be up to a heartbeat old
+    election.beat()
+    if not election.is_leader:
+        logger.info("Skipping scheduled discovery: another worker holds the scheduler lease")
+    return election.is_leader
+
+async def scheduled_discovery():
+    if not _is_leader():
+        return
+    # Coalesces with a /run-now run that is already in flight
+    run, _ = run_manager.trigger("scheduler")
+    await run_manager.wait(run)
+
+async def scheduled_tick():
+    """Adaptive cadence: a small run over just the subreddits / sources that are due."""
+    if run_manager.busy():
+        # Whatever is due now is still due once the current run is done
+        return
+    if not _is_leader():
+        return
+
+    enabled = providers.enabled_sources()
+    cadence = open_cadence_planner()
+    subreddits = cadence.due_subreddits() if "reddit" in enabled else []
+    sources = (["reddit"] if subreddits else []) + cadence.due_sources([s for s in enabled if s != "reddit"])
+    if not sources:
+        return
+    logger.info(f"Due: {', '.join(sources)} ({len(subreddits)} subreddits)")
+    run_manager.trigger("scheduler", sources=sources, subreddits=subreddits)
+
 def start_scheduler():
+    global election
+    election = LeaderElection(
+        Lease(lease_path(), "scheduler", settings.LEADER_LEASE_SECONDS),
+        heartbeat=settings.LEADER_HEARTBEAT_SECONDS
+    )
+    election.start()
+
+    if settings.ADAPTIVE_SCHEDULING:
+        scheduler.add_job(scheduled_tick, 'interval', minutes=settings.SCHEDULER_TICK_MINUTES, id='discovery_tick')
+        scheduler.start()
+        logger.info(f"Scheduler started. Job 'discovery_tick' polls due sources every {settings.SCHEDULER_TICK_MINUTES} min.")
+        return
+
     # Run every 24 hours
-    scheduler.add_job(run_discovery_cycle, 'interval', hours=24, id='daily_discovery')
+    scheduler.add_job(scheduled_discovery, 'interval', hours=24, id='daily_discovery')
     scheduler.start()
     logger.info("Scheduler started. Job 'daily_discovery' registered for every 24h.")
+
+def stop_scheduler():
+    if election is not None:
+        election.stop()
+    scheduler.shutdown(wait=False)
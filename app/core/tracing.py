@@ -0,0 +1,219 @@
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import time
+from collections import defaultdict, deque
+from typing import Any, Dict, List, Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Set by run_discovery_cycle; stage tasks and their children inherit it
+current_run_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_run_id", default=None)
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+class _NoopSpan:
+    """Returned when tracing is off: no allocation, no clock reads."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def set_result(self, result):
+        pass
+
+_NOOP = _NoopSpan()
+
+def _describe(subject) -> Dict[str, Any]:
+    """lead_id(s) / row count for whatever a stage handles: a Lead, a list of Leads or a LeadBatch."""
+    if subject is None:
+        return {}
+    if hasattr(subject, "lead_id"):
+        return {"lead_id": subject.lead_id}
+    if isinstance(subject, list):
+        return {"lead_ids": [lead.lead_id for lead in subject if hasattr(lead, "lead_id")]}
+    return {"rows": len(subject)}
+
+class Span:
+    __slots__ = ("name", "subject", "result", "attrs", "span_id", "parent_id", "run_id", "start", "_started", "_token")
+
+    def __init__(self, name: str, subject, attrs: dict):
+        self.name = name
+        self.subject = subject
+        self.result = None
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """Attach attributes known only once the work is done (e.g. posts fetched)."""
+        self.attrs.update(attrs)
+
+    def set_result(self, result):
+        """What the stage passed on (e.g. dedup survivors), described like the subject with an out_ prefix."""
+        self.result = result
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.span_id = next(tracer.ids)
+        self.parent_id = parent.span_id if parent else None
+        self.run_id = current_run_id.get()
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._started
+        _current_span.reset(self._token)
+        record = {
+            "run_id": self.run_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_s": round(duration, 6),
+            **_describe(self.subject),
+            **{f"out_{key}": value for key, value in _describe(self.result).items() if key != "rows"},
+            **self.attrs,
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        tracer.export(record)
+        return False
+
+def span(name: str, subject=None, **attrs):
+    """
+    Timed span around a piece of work: `with tracing.span("draft", lead): ...`.
+    `subject` (Lead, list of Leads or LeadBatch) is only inspected when tracing is on.
+    """
+    if not settings.TRACING_ENABLED:
+        return _NOOP
+    return Span(name, subject, attrs)
+
+class Tracer:
+    """
+    Span sink: an in-memory ring buffer (served by /runs/{id}/trace) and
+    optionally a size-rotated JSONL file under DATA_DIR/traces.
+    """
+    def __init__(self):
+        self.ids = itertools.count(1)
+        self.ring: deque = deque(maxlen=settings.TRACE_RING_SIZE)
+        self._file_logger: Optional[logging.Logger] = None
+
+    def _jsonl_path(self) -> str:
+        return os.path.join(settings.DATA_DIR, "traces", "spans.jsonl")
+
+    def _file(self) -> logging.Logger:
+        if self._file_logger is None:
+            os.makedirs(os.path.dirname(self._jsonl_path()), exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                self._jsonl_path(), maxBytes=settings.TRACE_JSONL_MAX_BYTES,
+                backupCount=settings.TRACE_JSONL_BACKUPS, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            file_logger = logging.getLogger(f"{__name__}.jsonl")
+            file_logger.handlers = [handler]
+            file_logger.setLevel(logging.INFO)
+            file_logger.propagate = False
+            self._file_logger = file_logger
+        return self._file_logger
+
+    def export(self, record: dict):
+        self.ring.append(record)
+        if settings.TRACE_JSONL:
+            try:
+                self._file().info(json.dumps(record))
+            except Exception as e:
+                logger.error(f"Failed to write trace span: {e}")
+
+    def spans(self, run_id: str) -> List[dict]:
+        found = [record for record in self.ring if record["run_id"] == run_id]
+        if found or not settings.TRACE_JSONL:
+            return found
+        # Rotated out of memory: fall back to the JSONL files, oldest first
+        paths = [f"{self._jsonl_path()}.{i}" for i in range(settings.TRACE_JSONL_BACKUPS, 0, -1)] + [self._jsonl_path()]
+        for path in paths:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    found.extend(record for record in map(json.loads, f) if record["run_id"] == run_id)
+            except FileNotFoundError:
+                continue
+        return found
+
+tracer = Tracer()
+
+def _lead_ids(record: dict) -> set:
+    lead_ids = set(record.get("lead_ids") or record.get("out_lead_ids") or ())
+    if "lead_id" in record:
+        lead_ids.add(record["lead_id"])
+    return lead_ids
+
+def for_lead(spans: List[dict], lead_id: str) -> List[dict]:
+    """Spans that handled the lead, plus everything nested in them (e.g. the Gemini call of its batch)."""
+    by_id = {record["span_id"]: record for record in spans}
+    matched = {record["span_id"] for record in spans if lead_id in _lead_ids(record)}
+
+    def inside_match(record) -> bool:
+        while record is not None:
+            if record["span_id"] in matched:
+                return True
+            record = by_id.get(record["parent_id"])
+        return False
+
+    return [record for record in spans if inside_match(record)]
+
+def breakdown(spans: List[dict], top_leads: int = 10) -> dict:
+    """
+    Flame-style view of a run's spans: time per call path (stage > sub-span),
+    plus the leads that spent the most time in stages, split by span name.
+    """
+    by_id = {record["span_id"]: record for record in spans}
+
+    def path(record) -> tuple:
+        names = [record["name"]]
+        parent = by_id.get(record["parent_id"])
+        while parent is not None:
+            names.append(parent["name"])
+            parent = by_id.get(parent["parent_id"])
+        return tuple(reversed(names))
+
+    root = {"name": "run", "count": 0, "total_s": 0.0, "children": {}}
+    leads: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for record in spans:
+        node = root
+        for name in path(record):
+            node = node["children"].setdefault(name, {"name": name, "count": 0, "total_s": 0.0, "children": {}})
+        node["count"] += 1
+        node["total_s"] += record["duration_s"]
+
+        # Batch spans (dedup, analyze) are charged to every lead in the batch
+        for lead_id in _lead_ids(record):
+            leads[lead_id][record["name"]] += record["duration_s"]
+
+    def finish(node: dict) -> dict:
+        children = sorted((finish(child) for child in node["children"].values()), key=lambda n: -n["total_s"])
+        node["total_s"] = round(node["total_s"], 6)
+        node["children"] = children
+        return node
+
+    root["count"] = len(spans)
+    root["total_s"] = round(max((r["start"] + r["duration_s"] for r in spans), default=0)
+                            - min((r["start"] for r in spans), default=0), 6)  # wall clock
+    slowest = sorted(leads.items(), key=lambda item: -sum(item[1].values()))[:top_leads]
+    return {
+        "spans": len(spans),
+        "flame": finish(root),
+        "slowest_leads": [
+            {"lead_id": lead_id, "total_s": round(sum(stages.values()), 6),
+             "stages": {name: round(seconds, 6) for name, seconds in stages.items()}}
+            for lead_id, stages in slowest
+        ],
+    }
@@ -1,78 +1,339 @@
 import logging
 import asyncio
-from app.services.reddit import RedditService
-from app.services.linkedin import LinkedinService
-from app.services.twitter import TwitterService
-from app.services.gemini import GeminiService
-from app.services.sheets import SheetsService
+import time
+from collections import Counter
+from typing import AsyncIterator, List, Optional
+from app.services.gemini import is_qualified
+from app.services.gemini_engine import BudgetExhausted, GeminiUnavailable
+from app.core.config import settings
+from app.core import metrics, providers, tracing
+from app.core.cadence import open_cadence_planner, subreddit_of
+from app.core.keywords import get_matcher
+from app.core.pipeline import DONE, PriorityQueue, Stage
+from app.core.priority import pre_score
 from app.models.lead import Lead
+from app.models.lead_batch import LeadBatch
+from app.models.run import Run
 
 logger = logging.getLogger(__name__)
 
-async def run_discovery_cycle():
+# Posts requested per cycle from each source
+SOURCE_LIMITS = {"reddit": 25, "linkedin": 10, "twitter": 20}
+
+async def _single_batch(fetch) -> AsyncIterator[LeadBatch]:
+    """Adapt a list-returning fetch to the streaming source interface."""
+    yield LeadBatch.from_leads(await fetch())
+
+def _source_stream(name: str, service, subreddits: Optional[List[str]] = None) -> AsyncIterator[LeadBatch]:
+    if name == "reddit":
+        # Streams subreddit by subreddit
+        return service.iter_recent_batches(limit=SOURCE_LIMITS[name], subreddits=subreddits)
+    return _single_batch(lambda: service.fetch_recent_posts(limit=SOURCE_LIMITS[name]))
+
+def _refresh_sheets():
+    # Blocking gspread calls, run in a worker thread
+    sheets = providers.get("sheets")
+    sheets.refresh()
+    return sheets
+
+def _near_dup_index():
+    # Long-lived: built (and loaded) on first use, re-read only after another worker saved it.
+    # Both are CPU-heavy at a few 100k entries, so this runs in a worker thread.
+    index = providers.get("near_dups")
+    index.refresh()
+    return index
+
+async def _prepare_sheets():
+    sheets = await asyncio.to_thread(_refresh_sheets)
+    # Lead store access stays on the loop: the pipeline uses the same SQLite connection
+    sheets.requeue_unsynced()
+    sheets.sync_statuses()
+    return sheets
+
+async def _fetch_source(name: str, stream: AsyncIterator[LeadBatch], timeout: float, outbox: asyncio.Queue, progress: dict):
+    """
+    Stream a single source into the pipeline with its own timeout.
+    Only time spent waiting on the source counts against the timeout, not time
+    blocked on a full queue (backpressure from the slower stages).
+    Never raises - a slow or failing source is reported and stops early.
+    """
+    logger.info(f"Fetching {name} posts...")
+    started = time.monotonic()
+    report = {"fetched": 0, "error": None, "duration_s": 0.0}
+
+    with tracing.span("fetch", source=name) as span:
+        await _stream_into(name, stream, timeout, outbox, progress, report)
+        span.set(fetched=report["fetched"], error=report["error"])
+
+    report["duration_s"] = round(time.monotonic() - started, 3)
+    metrics.SOURCE_FETCH_SECONDS.observe(report["duration_s"], source=name)
+    metrics.SOURCE_POSTS.inc(report["fetched"], source=name)
+    if report["error"]:
+        metrics.SOURCE_ERRORS.inc(source=name)
+    logger.info(f"Source {name}: {report['fetched']} leads in {report['duration_s']}s")
+    return name, report
+
+async def _stream_into(name: str, stream: AsyncIterator[LeadBatch], timeout: float, outbox: asyncio.Queue, progress: dict, report: dict):
+    waited = 0.0
+    try:
+        while True:
+            wait_started = time.monotonic()
+            try:
+                batch = await asyncio.wait_for(stream.__anext__(), timeout=max(timeout - waited, 0))
+            except StopAsyncIteration:
+                break
+            waited += time.monotonic() - wait_started
+
+            if len(batch) or batch.low_relevance:
+                await outbox.put(batch)
+            report["fetched"] += len(batch) + batch.low_relevance
+            progress[name] = report["fetched"]
+    except asyncio.TimeoutError:
+        report["error"] = f"timed out after {timeout}s"
+        logger.error(f"Source {name} timed out after {timeout}s")
+    except Exception as e:
+        report["error"] = str(e)
+        logger.error(f"Source {name} failed: {e}")
+    finally:
+        await stream.aclose()
+
+async def run_discovery_cycle(run: Optional[Run] = None, sources: Optional[List[str]] = None, subreddits: Optional[List[str]] = None):
+    """
+    Streaming pipeline: ingest -> prefilter -> dedup -> analyze -> draft -> persist.
+    Stages are connected by bounded queues, so the first leads are saved while
+    sources are still being fetched and memory stays flat however much a cycle
+    ingests. Live stage progress and counts are reported into `run`.
+
+    Up to dedup, posts travel as columnar LeadBatches; a Lead is only built
+    for posts that survive the prefilter and dedup. Reddit matches keywords
+    while parsing, so its non-matching posts never enter the queues.
+
+    Leads wait for analysis in a priority queue ordered by pre_score, so the
+    Gemini budget goes to the strongest candidates first (sources outpace the
+    LLM by far, so most of a cycle's candidates are queued by the time the budget
+    gets tight). Whatever the budget can't cover is carried over to the next cycle.
+
+    `sources` / `subreddits` (or the run's scope) limit what is polled; each
+    poll feeds the adaptive cadence (app.core.cadence).
+    """
+    run = run if run is not None else Run(triggers=["direct"])
+    sources = sources if sources is not None else run.sources
+    subreddits = subreddits if subreddits is not None else run.subreddits
     logger.info("Starting Daily Discovery Cycle...")
+    cycle_started = time.monotonic()
+    # Stage tasks created below inherit it, so their spans carry the run_id
+    tracing.current_run_id.set(run.run_id)
     
-    # Initialize Services
-    reddit = RedditService()
-    linkedin = LinkedinService()
-    twitter = TwitterService()
-    gemini = GeminiService()
-    sheets = SheetsService()
-    
-    # 1. Ingest
-    leads: list[Lead] = []
-    
-    # Reddit
-    logger.info("Fetching Reddit posts...")
-    leads.extend(reddit.fetch_recent_posts(limit=25))
-    
-    # LinkedIn
-    if linkedin.enabled:
-        logger.info("Fetching LinkedIn posts...")
-        leads.extend(await linkedin.fetch_recent_posts(limit=10)) 
-        
-    # Twitter
-    if twitter.enabled:
-        logger.info("Fetching X (Twitter) posts...")
-        leads.extend(await twitter.fetch_recent_posts(limit=20))
-        
-    logger.info(f"Total raw leads fetched: {len(leads)}")
-    
-    processed_count = 0
-    skipped_dupes = 0
-    skipped_quality = 0
-    saved_count = 0
-    
-    for lead in leads:
-        # 2. Deduplication (Fast check)
-        if sheets.is_duplicate(lead):
-            skipped_dupes += 1
-            continue
-            
-        # 3. AI Analysis
-        # We only analyze if it passed dedupe
-        try:
-            lead = await gemini.analyze_pain(lead)
-            
-            if not lead.has_pain or lead.urgency_score < 6:
-                skipped_quality += 1
+    # Long-lived services, imported and built on first use (only enabled sources)
+    sources_enabled = {
+        name: providers.get(name) for name in providers.enabled_sources()
+        if sources is None or name in sources
+    }
+    gemini = providers.get("gemini")
+    gemini.start_cycle()
+    store = providers.get("lead_store")
+    near_dups = await asyncio.to_thread(_near_dup_index) if settings.NEAR_DUP_ENABLED else None
+    # The local store is the primary write path; Sheets is only a mirror, so
+    # connect / refresh it (blocking gspread calls) in the background during ingest.
+    sheets_task = asyncio.create_task(_prepare_sheets())
+
+    counts = run.counts
+    counts.update({"saved": 0, "dupes": 0, "near_dupes": 0, "low_relevance": 0, "low_quality": 0, "deferred": 0})
+    saved_by_subreddit = Counter()  # lead yield, for the cadence
+    matcher = get_matcher()
+
+    async def prefilter(batch: LeadBatch):
+        if batch.prefiltered:
+            # Matched while parsing (Reddit), only the count of dropped posts comes along
+            counts["low_relevance"] += batch.low_relevance
+            return [batch] if len(batch) else None
+        # Keyword prefilter, shared by every source, one pass over the batch
+        batch.relevance_score, batch.matched_keywords = matcher.score_many(batch.post_excerpt)
+        keep = [row for row, score in enumerate(batch.relevance_score) if score >= settings.MIN_RELEVANCE_SCORE]
+        counts["low_relevance"] += len(batch) - len(keep)
+        return [batch.take(keep)] if keep else None
+
+    async def dedup(batch: LeadBatch):
+        # Indexed local lookups for the whole batch, plus keys of rows added to the sheet by hand
+        sheets = await sheets_task
+        duplicates = store.duplicate_rows(batch) | sheets.duplicate_rows(batch)
+        counts["dupes"] += len(duplicates)
+        metrics.DEDUP_CHECKS.inc(len(duplicates), result="hit")
+        metrics.DEDUP_CHECKS.inc(len(batch) - len(duplicates), result="miss")
+
+        survivors = []
+        for row in range(len(batch)):
+            if row % 200 == 199:
+                # SimHash is CPU-bound; a big batch shouldn't stall the Gemini calls in flight
+                await asyncio.sleep(0)
+            if row in duplicates:
                 continue
-                
-            # 4. Draft Outreach
+            # Near-duplicate content (cross-posts, copies between platforms)
+            if near_dups:
+                if near_dups.check_and_add(batch.post_excerpt[row]):
+                    counts["near_dupes"] += 1
+                    metrics.NEAR_DUP_CHECKS.inc(result="hit")
+                    continue
+                metrics.NEAR_DUP_CHECKS.inc(result="miss")
+            survivors.append(batch.lead(row))
+        return survivors
+
+    budget_exhausted = False
+
+    def defer(leads: list[Lead], stage: str, exhausted: bool = True):
+        # Out of Gemini budget (or the request failed for good): park the leads
+        # for the next cycle instead of dropping them
+        nonlocal budget_exhausted
+        budget_exhausted = budget_exhausted or exhausted
+        store.defer(leads, stage, pre_score)
+        counts["deferred"] += len(leads)
+        metrics.LLM_DEFERRED.inc(len(leads), stage=stage)
+
+    fused = settings.GEMINI_ANALYSIS_MODE == "fused"
+
+    async def analyze(batch: list[Lead]):
+        # Several leads share one request; GeminiService bounds concurrency and RPM
+        if budget_exhausted:
+            # Spent for the rest of the cycle, don't even ask
+            defer(batch, "analyze")
+            return None
+        try:
+            if fused:
+                batch = await gemini.analyze_and_draft_batch(batch)
+            else:
+                batch = await gemini.analyze_pain_batch(batch)
+        except BudgetExhausted:
+            defer(batch, "analyze")
+            return None
+        except GeminiUnavailable:
+            # Just this batch: the next one may well get through
+            defer(batch, "analyze", exhausted=False)
+            return None
+        qualified = [lead for lead in batch if is_qualified(lead)]
+        counts["low_quality"] += len(batch) - len(qualified)
+        return qualified
+
+    async def draft(lead: Lead):
+        if lead.suggested_outreach_message:
+            # Already drafted by the fused analysis call
+            return [lead]
+        if budget_exhausted:
+            defer([lead], "draft")
+            return None
+        try:
             lead.suggested_outreach_message = await gemini.draft_outreach(lead)
-            
-            # 5. Save
-            if sheets.append_lead(lead):
-                saved_count += 1
-                logger.info(f"Saved lead: {lead.platform} - {lead.author_handle}")
-                
-        except Exception as e:
-            logger.error(f"Error processing lead {lead.post_url}: {e}")
-            
-    logger.info(f"Discovery Cycle Complete. Saved: {saved_count}, Dupes: {skipped_dupes}, Low Quality: {skipped_quality}")
+        except BudgetExhausted:
+            # The analysis is cached, next cycle only pays for the draft
+            defer([lead], "draft")
+            return None
+        return [lead]
+
+    async def persist(lead: Lead):
+        # Save locally, then mirror to Sheets (write-behind)
+        sheets = await sheets_task
+        if store.add(lead):
+            counts["saved"] += 1
+            if lead.platform == "Reddit":
+                saved_by_subreddit[subreddit_of(lead.post_url)] += 1
+            logger.info(f"Saved lead: {lead.platform} - {lead.author_handle}")
+            await sheets.append_lead(lead)
+        return None
+
+    queue_size = settings.PIPELINE_QUEUE_SIZE
+    # raw / relevant carry LeadBatches, the rest single Leads
+    raw, relevant = (asyncio.Queue(maxsize=settings.PIPELINE_BATCH_QUEUE_SIZE) for _ in range(2))
+    analyzed, drafted = (asyncio.Queue(maxsize=queue_size) for _ in range(2))
+    unique = PriorityQueue(maxsize=settings.PIPELINE_PRIORITY_QUEUE_SIZE, key=pre_score)
+    stages = [
+        Stage("prefilter", prefilter, raw, relevant, progress=run.stages, item_size=lambda batch: len(batch) + batch.low_relevance),
+        Stage("dedup", dedup, relevant, unique, progress=run.stages, item_size=len),
+        Stage("analyze", analyze, unique, analyzed, progress=run.stages,
+              workers=settings.PIPELINE_ANALYZE_WORKERS, batch_size=settings.GEMINI_BATCH_SIZE),
+        Stage("draft", draft, analyzed, drafted, progress=run.stages, workers=settings.PIPELINE_DRAFT_WORKERS),
+        Stage("persist", persist, drafted, progress=run.stages),
+    ]
+    stage_tasks = [asyncio.create_task(stage.run()) for stage in stages]
+
+    # Ingest
+    # Sources run concurrently so the ingest phase only takes as long as the
+    # slowest enabled source. Each one gets its own timeout and error report.
+    streams = {
+        name: _source_stream(name, service, subreddits)
+        for name, service in sources_enabled.items()
+        if getattr(service, "enabled", True)
+    }
+
+    async def resume_backlog():
+        # Leads the budget didn't cover last time compete with the new ones.
+        # Runs next to the sources: draft leads can fill the bounded draft queue,
+        # and ingest shouldn't wait behind them.
+        backlog = store.take_pending(
+            settings.PIPELINE_PRIORITY_QUEUE_SIZE, settings.LLM_BACKLOG_MAX_AGE_HOURS * 3600
+        )
+        if backlog:
+            logger.info(f"Resuming {len(backlog)} leads deferred by Gemini")
+        for stage, lead in backlog:
+            if not store.is_duplicate(lead):
+                await (analyzed if stage == "draft" else unique).put(lead)
+
+    sheets = None
+    run.stages["ingest"] = {}
+    backlog_task = asyncio.create_task(resume_backlog())
+    try:
+        results = await asyncio.gather(*(
+            _fetch_source(name, stream, settings.SOURCE_FETCH_TIMEOUT_SECONDS, raw, run.stages["ingest"])
+            for name, stream in streams.items()
+        ))
+        # Everything must be queued before the end marker goes down the pipeline
+        await backlog_task
+        await raw.put(DONE)
+        await asyncio.gather(*stage_tasks)
+        sheets = await sheets_task
+    finally:
+        backlog_task.cancel()
+        for task in stage_tasks:
+            task.cancel()
+        if "reddit" in sources_enabled:
+            # Connections would be stale by the next cycle anyway
+            await sources_enabled["reddit"].aclose()
+        # Write-behind buffer: always flush at the end of the cycle
+        if sheets is not None:
+            await sheets.close()
+
+    reports = dict(results)
+    logger.info(f"Total raw leads fetched: {sum(report['fetched'] for report in reports.values())}")
+
+    # Feed what we saw back into the polling cadence
+    cadence = open_cadence_planner()
+    for name in reports:
+        if name == "reddit":
+            cadence.record_polls(sources_enabled["reddit"].last_polls, saved_by_subreddit)
+        elif not reports[name]["error"]:
+            cadence.record_source(name)
+    cadence.save()
+
+    logger.info(f"Discovery Cycle Complete. Saved: {counts['saved']}, Dupes: {counts['dupes']}, Near Dupes: {counts['near_dupes']}, Low Relevance: {counts['low_relevance']}, Low Quality: {counts['low_quality']}, Deferred: {counts['deferred']}")
+    logger.info(f"LLM cache: {gemini.cache_stats()}")
+    logger.info(f"Gemini budget: {gemini.budget_stats()}")
+    if near_dups:
+        await asyncio.to_thread(near_dups.save)
+        near_dup_stats = near_dups.stats()
+        metrics.NEAR_DUP_ENTRIES.set(near_dup_stats["entries"])
+        metrics.NEAR_DUP_MEMORY_BYTES.set(near_dup_stats["memory_bytes"])
+        metrics.NEAR_DUP_COLLISION_RATE.set(near_dup_stats["collision_rate"])
+        logger.info(f"Near-duplicate index: {near_dup_stats}")
+
+    duration = time.monotonic() - cycle_started
+    metrics.CYCLE_SECONDS.observe(duration)
+    metrics.LAST_CYCLE_TIMESTAMP.set(time.time())
+    for outcome, count in counts.items():
+        metrics.CYCLE_LEADS.inc(count, outcome=outcome)
     
     return {
-        "saved": saved_count,
-        "dupes": skipped_dupes,
-        "low_quality": skipped_quality
+        "run_id": run.run_id,
+        **counts,
+        "analysis_mode": settings.GEMINI_ANALYSIS_MODE,
+        "duration_s": round(duration, 3),
+        "subreddits": subreddits,
+        "sources": reports
     }
@@ -1,34 +1,143 @@
-from fastapi import FastAPI, BackgroundTasks
+import csv
+import io
+import json
+from typing import Literal, Optional
+from fastapi import Depends, FastAPI, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from app.core.config import settings
-from app.core.scheduler import start_scheduler
-from app.core.workflow import run_discovery_cycle
+from app.core import metrics, providers, tracing
+from app.core import scheduler
+from app.core.leader import WORKER_ID
+from app.core.cadence import open_cadence_planner
+from app.core.runs import run_manager
+from app.models.lead_query import LeadFilter, decode_cursor, encode_cursor
+from app.services.lead_store import LEAD_COLUMNS
 
 app = FastAPI(title="OpsPilot Lead MCP")
 
 @app.on_event("startup")
 async def startup_event():
-    start_scheduler()
+    scheduler.start_scheduler()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Releases the scheduler lease so another worker takes over immediately
+    scheduler.stop_scheduler()
 
 @app.get("/health")
 async def health_check():
     return {
         "status": "active",
         "service": "OpsPilot Lead MCP",
+        "worker": {
+            "id": WORKER_ID,
+            "scheduler_leader": bool(scheduler.election and scheduler.election.is_leader)
+        },
         "config": {
             "reddit_enabled": bool(settings.REDDIT_CLIENT_ID),
-            "linkedin_enabled": bool(settings.LINKEDIN_USERNAME and settings.LINKEDIN_PASSWORD)
+            "linkedin_enabled": bool(settings.LINKEDIN_USERNAME and settings.LINKEDIN_PASSWORD),
+            "sources": providers.enabled_sources()
         }
     }
 
 @app.post("/run-now")
-async def run_discovery_verified(background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_discovery_cycle)
-    return {"status": "Discovery job triggered in background"}
+async def run_discovery_verified():
+    run, coalesced = run_manager.trigger("api")
+    return {
+        "status": "Joined discovery run already in progress" if coalesced else "Discovery job triggered in background",
+        "run_id": run.run_id,
+        "coalesced": coalesced
+    }
+
+@app.get("/runs")
+async def list_runs():
+    return [
+        {key: value for key, value in run.model_dump().items() if key not in ("stages", "result")}
+        for run in run_manager.history()
+    ]
+
+@app.get("/runs/{run_id}")
+async def get_run(run_id: str):
+    run = run_manager.get(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return run
+
+@app.get("/runs/{run_id}/trace")
+async def get_run_trace(run_id: str, lead_id: Optional[str] = None):
+    spans = tracing.tracer.spans(run_id)
+    if not spans:
+        if run_manager.get(run_id) is None:
+            raise HTTPException(status_code=404, detail="Run not found")
+        raise HTTPException(status_code=404, detail="No spans for this run (TRACING_ENABLED is off, or they were rotated out)")
+    if lead_id:
+        spans = tracing.for_lead(spans, lead_id)
+    return {"run_id": run_id, "lead_id": lead_id, **tracing.breakdown(spans)}
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(LEAD_COLUMNS)
+    for row in rows:
+        writer.writerow([row[column] for column in LEAD_COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()  # header only, if nothing matched
+
+@app.get("/leads")
+async def get_leads(
+    filters: LeadFilter = Depends(),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    format: Literal["json", "ndjson", "csv"] = "json",
+):
+    """
+    Saved leads from the local store, newest first. `json` returns one page plus
+    `next_cursor`; `ndjson`/`csv` stream every match from `cursor` on (limit ignored).
+    lead_status reflects edits made in Google Sheets as of the last status
+    sync (every SHEETS_STATUS_SYNC_MINUTES).
+    """
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    store = providers.get("lead_store")
+
+    if format == "json":
+        # Off the event loop, which the scheduler and the pipeline share
+        leads = await run_in_threadpool(store.query, filters, limit, after)
+        next_cursor = None
+        if len(leads) == limit:
+            next_cursor = encode_cursor((leads[-1]["timestamp_utc"], leads[-1]["lead_id"]))
+        return {"leads": leads, "next_cursor": next_cursor}
+
+    # Sync generators: Starlette iterates them in its threadpool, off the event loop
+    rows = store.iter_query(filters, after)
+    if format == "ndjson":
+        return StreamingResponse((json.dumps(row) + "\n" for row in rows), media_type="application/x-ndjson")
+    return StreamingResponse(
+        _csv_lines(rows), media_type="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="leads.csv"'}
+    )
 
 @app.get("/stats")
 async def get_stats():
-    # In a real app we'd query the DB or Sheet for stats.
-    # For now return placeholder or global counters if we added them.
+    leads = providers.get("lead_store").summary()
+
     return {
-        "message": "Stats implementation requires persistent storage reading (future)"
+        "leads": leads,
+        "summary": {
+            "dedup_hit_rate": metrics.ratio(metrics.DEDUP_CHECKS, {"result": "hit"}, {"result": "miss"}),
+            "llm_cache_hit_rate": metrics.ratio(metrics.LLM_CACHE_LOOKUPS, {"result": "hit"}, {"result": "miss"}),
+            "gemini_quota_errors": metrics.GEMINI_QUOTA_ERRORS.get(),
+        },
+        "cadence": open_cadence_planner().stats(),
+        "metrics": metrics.registry.to_dict()
     }
+
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.registry.render_prometheus(), media_type="text/plain; version=0.0.4")
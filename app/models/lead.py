@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Literal
+from typing import List, Optional, Literal
 from datetime import datetime
 import uuid
 
@@ -11,6 +11,15 @@ class Lead(BaseModel):
     author_profile_url: Optional[str] = None
     post_url: str
     post_excerpt: str
+
+    # Keyword prefilter (not persisted)
+    relevance_score: float = 0.0
+    matched_keywords: List[str] = []
+
+    # Source signals for LLM prioritization (not persisted)
+    posted_utc: Optional[float] = None
+    upvotes: int = 0
+    comments: int = 0
     
     # AI Analysis Results
     has_pain: bool = False
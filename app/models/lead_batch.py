@@ -0,0 +1,102 @@
+import math
+from array import array
+from typing import Iterable, List, Optional, Sequence
+from app.models.lead import Lead
+
+class LeadBatch:
+    """
+    Column-oriented batch of scraped posts for the pre-LLM stages (prefilter,
+    dedup). Most posts are dropped there, so they never pay for a pydantic
+    Lead (validation, uuid4, timestamps); only survivors are materialized.
+    Numeric columns are stdlib arrays, strings are plain lists.
+    A source may keyword-match posts itself while parsing (Reddit, the bulk
+    of the volume) and only append the matches: `prefiltered` is then set and
+    `low_relevance` counts the posts it dropped.
+    """
+    COLUMNS = (
+        "platform", "author_handle", "author_profile_url", "post_url", "post_excerpt",
+        "posted_utc", "upvotes", "comments", "relevance_score", "matched_keywords",
+    )
+    __slots__ = COLUMNS + ("prefiltered", "low_relevance")
+
+    def __init__(self):
+        self.platform: List[str] = []
+        self.author_handle: List[str] = []
+        self.author_profile_url: List[Optional[str]] = []
+        self.post_url: List[str] = []
+        self.post_excerpt: List[str] = []
+        self.posted_utc = array("d")  # NaN when unknown
+        self.upvotes = array("q")
+        self.comments = array("q")
+        # Filled in by the prefilter
+        self.relevance_score = array("d")
+        self.matched_keywords: List[List[str]] = []
+        self.prefiltered = False
+        self.low_relevance = 0
+
+    def __len__(self) -> int:
+        return len(self.post_url)
+
+    def append(
+        self,
+        platform: str,
+        author_handle: str,
+        post_url: str,
+        post_excerpt: str,
+        author_profile_url: Optional[str] = None,
+        posted_utc: Optional[float] = None,
+        upvotes: int = 0,
+        comments: int = 0,
+        relevance_score: float = 0.0,
+        matched_keywords: Optional[List[str]] = None,
+    ):
+        self.platform.append(platform)
+        self.author_handle.append(author_handle)
+        self.author_profile_url.append(author_profile_url)
+        self.post_url.append(post_url)
+        self.post_excerpt.append(post_excerpt)
+        self.posted_utc.append(math.nan if posted_utc is None else posted_utc)
+        self.upvotes.append(upvotes)
+        self.comments.append(comments)
+        self.relevance_score.append(relevance_score)
+        self.matched_keywords.append(matched_keywords or [])
+
+    @classmethod
+    def from_leads(cls, leads: Iterable[Lead]) -> "LeadBatch":
+        """For sources that already build Leads (low volume: LinkedIn, X)."""
+        batch = cls()
+        for lead in leads:
+            batch.append(
+                lead.platform, lead.author_handle, lead.post_url, lead.post_excerpt,
+                author_profile_url=lead.author_profile_url, posted_utc=lead.posted_utc,
+                upvotes=lead.upvotes, comments=lead.comments
+            )
+        return batch
+
+    def take(self, rows: Sequence[int]) -> "LeadBatch":
+        """New batch holding only the given rows, in order."""
+        batch = LeadBatch()
+        for column in self.COLUMNS:
+            values = getattr(self, column)
+            picked = [values[i] for i in rows]
+            setattr(batch, column, array(values.typecode, picked) if isinstance(values, array) else picked)
+        batch.prefiltered = self.prefiltered
+        return batch
+
+    def lead(self, row: int) -> Lead:
+        posted = self.posted_utc[row]
+        return Lead(
+            platform=self.platform[row],
+            author_handle=self.author_handle[row],
+            author_profile_url=self.author_profile_url[row],
+            post_url=self.post_url[row],
+            post_excerpt=self.post_excerpt[row],
+            posted_utc=None if math.isnan(posted) else posted,
+            upvotes=self.upvotes[row],
+            comments=self.comments[row],
+            relevance_score=self.relevance_score[row],
+            matched_keywords=self.matched_keywords[row],
+        )
+
+    def to_leads(self) -> List[Lead]:
+        return [self.lead(row) for row in range(len(self))]
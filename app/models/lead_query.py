@@ -0,0 +1,37 @@
+import base64
+import json
+from datetime import datetime, timezone
+from pydantic import BaseModel
+from typing import Literal, Optional, Tuple
+
+class LeadFilter(BaseModel):
+    """Query parameters for /leads. Time bounds apply to timestamp_utc (when the lead was saved)."""
+    platform: Optional[Literal["Reddit", "X", "LinkedIn"]] = None
+    pain_category: Optional[str] = None
+    min_urgency: Optional[int] = None
+    max_urgency: Optional[int] = None
+    lead_status: Optional[str] = None
+    since: Optional[datetime] = None  # inclusive
+    until: Optional[datetime] = None  # exclusive
+
+def utc_iso(value: datetime) -> str:
+    """Same naive-UTC isoformat as Lead.timestamp_utc, so stored strings compare correctly."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat()
+
+# Keyset position: (timestamp_utc, lead_id) of the last lead returned
+Cursor = Tuple[str, str]
+
+def encode_cursor(cursor: Cursor) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(cursor)).encode("utf-8")).decode("ascii")
+
+def decode_cursor(token: str) -> Cursor:
+    """Raises ValueError for anything that is not a cursor we issued."""
+    try:
+        timestamp, lead_id = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(timestamp, str) or not isinstance(lead_id, str):
+        raise ValueError("Invalid cursor")
+    return timestamp, lead_id
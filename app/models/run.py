@@ -0,0 +1,23 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Literal, Optional
+from datetime import datetime
+import uuid
+
+class Run(BaseModel):
+    run_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    triggers: List[str] = []  # every trigger coalesced into this run
+    worker: Optional[str] = None  # uvicorn worker running it
+    # Scope, None = everything enabled (scheduled runs only poll what is due)
+    sources: Optional[List[str]] = None
+    subreddits: Optional[List[str]] = None
+    status: Literal["running", "completed", "failed", "skipped"] = "running"  # skipped: another worker was mid-cycle
+    started_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat())
+    finished_at: Optional[str] = None
+    duration_s: Optional[float] = None
+
+    # Live progress, updated by the pipeline while the run is in flight
+    stages: Dict[str, Dict[str, int]] = {}
+    counts: Dict[str, int] = {}
+
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
@@ -1,88 +1,358 @@
-import google.generativeai as genai
 from app.core.config import settings
+from app.core.leader import lease_path
 from app.models.lead import Lead
+from app.services.gemini_engine import BudgetExhausted, GeminiBudget, GeminiEngine, GeminiUnavailable
+from app.services.llm_cache import LLMCache, version_tag
+from functools import lru_cache
+from typing import List, Optional
+import asyncio
 import logging
 import json
+import os
 
 logger = logging.getLogger(__name__)
 
-# Configure Gemini
-genai.configure(api_key=settings.GEMINI_API_KEY)
+MODEL_NAME = 'gemini-1.5-flash'  # Free tier model
 
-class GeminiService:
-    def __init__(self):
-        try:
-            logger.info(f"google-generativeai version: {genai.__version__}")
-            for m in genai.list_models():
-                if 'generateContent' in m.supported_generation_methods:
-                    logger.info(f"Available model: {m.name}")
-        except Exception as e:
-            logger.error(f"Failed to list models: {e}")
+# Shared between the single-lead and batch classification prompts
+ANALYSIS_SCHEMA = """  "has_pain": boolean,
+          "pain_category": "Chasing updates" | "Reporting delays" | "Lack of visibility" | "Tool overload" | "Other" | null,
+          "pain_summary": "Short explanation in plain English" | null,
+          "urgency_score": integer (1-10),
+          "reasoning": "Why this qualifies\""""
 
-        self.model = genai.GenerativeModel('gemini-1.5-flash')  # Free tier model
+ANALYSIS_CRITERIA = """
+        Criteria:
+        - has_pain: true if the author is a manager/founder expressing frustration about operations, reporting, or visibility.
+        - urgency_score: 1 (low) to 10 (high)."""
 
-    async def analyze_pain(self, lead: Lead) -> Lead:
-        prompt = f"""
+ANALYZE_PROMPT = """
         Analyze the following social media post for operational pain points experienced by managers or founders.
         
         Post Content:
-        {lead.post_excerpt}
+        {post_excerpt}
 
         Return strictly valid JSON with no markdown formatting. The JSON must match this schema:
         {{
-          "has_pain": boolean,
-          "pain_category": "Chasing updates" | "Reporting delays" | "Lack of visibility" | "Tool overload" | "Other" | null,
-          "pain_summary": "Short explanation in plain English" | null,
-          "urgency_score": integer (1-10),
-          "reasoning": "Why this qualifies"
+        {schema}
         }}
-        
-        Criteria:
-        - has_pain: true if the author is a manager/founder expressing frustration about operations, reporting, or visibility.
-        - urgency_score: 1 (low) to 10 (high).
+        {criteria}
+        """
+
+BATCH_ANALYZE_PROMPT = """
+        Analyze each of the following social media posts for operational pain points experienced by managers or founders.
+
+        Posts (JSON array):
+        {posts}
+
+        Return a JSON array with exactly one object per post, in any order. Each object must match this schema:
+        {{
+          "lead_id": string (copied unchanged from the input),
+        {schema}
+        }}
+        {criteria}
+        """
+
+# Draft instructions, shared by the standalone and fused prompts
+DRAFT_INTRO = """
+        Draft a very short (max 3 sentences), casual, non-salesy DM to this person.
+        Pretend you are a rough-around-the-edges founder (OpsPilot) who solves this exact pain.
+        """
+
+DRAFT_RULES = """
+        Rules:
+        - No emojis.
+        - No links.
+        - No "I hope this finds you well".
+        - Just relate to the pain and offer a quick "same here" or "we fixed this by X".
+        - Sound valid, not spammy.
         """
 
+DRAFT_PROMPT = DRAFT_INTRO + """
+        Context:
+        Their Pain: {pain_summary}
+        Category: {pain_category}
+        """ + DRAFT_RULES
+
+# Fused mode: classification and, for qualifying posts only, the draft in one call
+FUSED_BATCH_PROMPT = """
+        Analyze each of the following social media posts for operational pain points experienced by managers or founders.
+
+        Posts (JSON array):
+        {posts}
+
+        Return a JSON array with exactly one object per post, in any order. Each object must match this schema:
+        {{
+          "lead_id": string (copied unchanged from the input),
+        {schema},
+          "outreach_message": string | null
+        }}
+        {criteria}
+        - outreach_message: null unless has_pain is true AND urgency_score >= {min_urgency}.
+          Only for those posts, write a message to the author following these instructions:
+        {draft_intro}
+        {draft_rules}
+        """
+
+# Cache versions: editing any prompt text or switching models invalidates old entries
+ANALYSIS_VERSION = version_tag(MODEL_NAME, ANALYSIS_SCHEMA, ANALYSIS_CRITERIA, ANALYZE_PROMPT, BATCH_ANALYZE_PROMPT)
+DRAFT_VERSION = version_tag(MODEL_NAME, DRAFT_PROMPT)
+FUSED_VERSION = version_tag(
+    MODEL_NAME, ANALYSIS_SCHEMA, ANALYSIS_CRITERIA, FUSED_BATCH_PROMPT, DRAFT_INTRO, DRAFT_RULES,
+    str(settings.MIN_URGENCY_SCORE)
+)
+
+def is_qualified(lead: Lead) -> bool:
+    """Leads worth an outreach draft (and a row in the lead store)."""
+    return lead.has_pain and lead.urgency_score >= settings.MIN_URGENCY_SCORE
+
+@lru_cache(maxsize=1)
+def available_models() -> tuple:
+    """Models supporting generateContent. A network call, so opt-in and cached per process."""
+    import google.generativeai as genai
+    try:
+        return tuple(m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods)
+    except Exception as e:
+        logger.error(f"Failed to list models: {e}")
+        return ()
+
+class GeminiService:
+    """
+    Long-lived (one per process, see app.core.providers): the SDK is imported
+    and configured on first construction rather than at import time.
+    """
+    def __init__(self):
+        import google.generativeai as genai
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+        logger.info(f"google-generativeai version: {genai.__version__}")
+        if settings.GEMINI_LIST_MODELS:
+            for name in available_models():
+                logger.info(f"Available model: {name}")
+
+        self.model = genai.GenerativeModel(MODEL_NAME)
+        self.budget = GeminiBudget(
+            lease_path(),  # shared with the other workers
+            cycle_requests=settings.GEMINI_CYCLE_REQUEST_BUDGET,
+            cycle_tokens=settings.GEMINI_CYCLE_TOKEN_BUDGET,
+            daily_requests=settings.GEMINI_DAILY_REQUEST_BUDGET,
+            daily_tokens=settings.GEMINI_DAILY_TOKEN_BUDGET
+        )
+        self.engine = GeminiEngine(
+            self.model,
+            max_concurrency=settings.GEMINI_MAX_CONCURRENCY,
+            requests_per_minute=settings.GEMINI_REQUESTS_PER_MINUTE,
+            max_retries=settings.GEMINI_MAX_RETRIES,
+            budget=self.budget
+        )
+
+        self.cache: Optional[LLMCache] = None
+        if settings.LLM_CACHE_ENABLED:
+            try:
+                self.cache = LLMCache(
+                    os.path.join(settings.DATA_DIR, "llm_cache.sqlite3"),
+                    ttl_seconds=settings.LLM_CACHE_TTL_HOURS * 3600,
+                    max_entries=settings.LLM_CACHE_MAX_ENTRIES
+                )
+            except Exception as e:
+                logger.error(f"Failed to open LLM cache, continuing without it: {e}")
+
+    def start_cycle(self):
+        """Reset the per-cycle part of the budget (the daily part carries on)."""
+        self.budget.start_cycle()
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats() if self.cache else {}
+
+    def budget_stats(self) -> dict:
+        return self.budget.stats()
+
+    def _cached_analysis(self, lead: Lead) -> bool:
+        """Apply a cached analysis to the lead. Returns True on a cache hit."""
+        if not self.cache:
+            return False
+        data = self.cache.get(ANALYSIS_VERSION, lead.post_excerpt)
+        if data is None:
+            return False
+        self._apply_analysis(lead, data)
+        return True
+
+    async def analyze_pain(self, lead: Lead) -> Lead:
+        if self._cached_analysis(lead):
+            return lead
+
+        prompt = ANALYZE_PROMPT.format(
+            post_excerpt=lead.post_excerpt, schema=ANALYSIS_SCHEMA, criteria=ANALYSIS_CRITERIA
+        )
+
         try:
-            response = self.model.generate_content(prompt)
+            response = await self.engine.generate(prompt)
             # Cleanup potential markdown ticks
             text = response.text.strip().replace('```json', '').replace('```', '')
             data = json.loads(text)
-            
-            lead.has_pain = data.get("has_pain", False)
-            if lead.has_pain:
-                lead.pain_category = data.get("pain_category")
-                lead.pain_summary = data.get("pain_summary")
-                lead.urgency_score = data.get("urgency_score", 0)
-                lead.notes = data.get("reasoning", "")
+            self._apply_analysis(lead, data)
+            if self.cache:
+                self.cache.put(ANALYSIS_VERSION, lead.post_excerpt, data)
                 
+        except BudgetExhausted:
+            # Not analyzed, let the workflow carry the lead over
+            raise
         except Exception as e:
             logger.error(f"Error analyzing pain with Gemini: {e}")
         
         return lead
 
+    async def analyze_pain_batch(self, leads: List[Lead]) -> List[Lead]:
+        """
+        Classify several leads with a single request, sharing the instruction
+        block and schema. Items the model drops or mangles fall back to
+        per-lead analyze_pain calls. Raises BudgetExhausted once the Gemini
+        budget is spent, and GeminiUnavailable when the batch request itself
+        keeps failing, so unanalyzed leads are never mistaken for "no pain".
+        """
+        pending = [lead for lead in leads if not self._cached_analysis(lead)]
+        if len(pending) <= 1:
+            for lead in pending:
+                await self.analyze_pain(lead)
+            return leads
+
+        prompt = BATCH_ANALYZE_PROMPT.format(
+            posts=self._posts_json(pending), schema=ANALYSIS_SCHEMA, criteria=ANALYSIS_CRITERIA
+        )
+        results = await self._generate_batch(prompt, len(pending))
+
+        missing = []
+        for lead in pending:
+            item = results.get(lead.lead_id)
+            if item is None:
+                missing.append(lead)
+                continue
+            self._apply_analysis(lead, item)
+            if self.cache:
+                self.cache.put(ANALYSIS_VERSION, lead.post_excerpt, item)
+
+        if missing:
+            logger.warning(f"Batch analysis returned {len(pending) - len(missing)}/{len(pending)} usable items, retrying the rest individually")
+            await asyncio.gather(*(self.analyze_pain(lead) for lead in missing))
+
+        return leads
+
+    async def analyze_and_draft_batch(self, leads: List[Lead]) -> List[Lead]:
+        """
+        Fused mode: one structured call per batch classifies every lead and
+        drafts the outreach message for those that qualify, instead of a second
+        draft_outreach round trip per lead. A draft the model returns for a lead
+        that doesn't qualify is thrown away. Items the model drops fall back to
+        analyze_pain; the workflow's draft stage then drafts them the usual way.
+        Raises like analyze_pain_batch when the request itself fails.
+        """
+        pending = [lead for lead in leads if not self._cached_fused(lead)]
+        if not pending:
+            return leads
+
+        prompt = FUSED_BATCH_PROMPT.format(
+            posts=self._posts_json(pending), schema=ANALYSIS_SCHEMA, criteria=ANALYSIS_CRITERIA,
+            min_urgency=settings.MIN_URGENCY_SCORE, draft_intro=DRAFT_INTRO.strip(), draft_rules=DRAFT_RULES.strip()
+        )
+        results = await self._generate_batch(prompt, len(pending))
+
+        missing = []
+        for lead in pending:
+            item = results.get(lead.lead_id)
+            if item is None:
+                missing.append(lead)
+                continue
+            self._apply_fused(lead, item)
+            if self.cache:
+                self.cache.put(FUSED_VERSION, lead.post_excerpt, item)
+
+        if missing:
+            logger.warning(f"Fused analysis returned {len(pending) - len(missing)}/{len(pending)} usable items, retrying the rest individually")
+            await asyncio.gather(*(self.analyze_pain(lead) for lead in missing))
+
+        return leads
+
+    def _cached_fused(self, lead: Lead) -> bool:
+        if not self.cache:
+            return False
+        data = self.cache.get(FUSED_VERSION, lead.post_excerpt)
+        if data is None:
+            return False
+        self._apply_fused(lead, data)
+        return True
+
+    def _apply_fused(self, lead: Lead, data: dict):
+        self._apply_analysis(lead, data)
+        message = data.get("outreach_message")
+        if is_qualified(lead) and isinstance(message, str) and message.strip():
+            lead.suggested_outreach_message = message.strip()
+
+    @staticmethod
+    def _posts_json(leads: List[Lead]) -> str:
+        return json.dumps([{"lead_id": lead.lead_id, "post": lead.post_excerpt} for lead in leads], ensure_ascii=False)
+
+    async def _generate_batch(self, prompt: str, size: int) -> dict:
+        """
+        Run a JSON-mode batch prompt. Returns the valid items keyed by lead_id.
+        A failed request or an unusable body is retried as a batch; falling back
+        to one request per lead would multiply the calls right when Gemini is
+        struggling. Raises GeminiUnavailable once GEMINI_BATCH_ATTEMPTS are spent.
+        """
+        attempts = max(1, settings.GEMINI_BATCH_ATTEMPTS)
+        for attempt in range(attempts):
+            try:
+                response = await self.engine.generate(
+                    prompt,
+                    generation_config={"response_mime_type": "application/json"}
+                )
+                data = json.loads(response.text)
+                if not isinstance(data, list):
+                    raise ValueError(f"expected a JSON array, got {type(data).__name__}")
+            except BudgetExhausted:
+                raise
+            except Exception as e:
+                error = e
+                logger.error(f"Error analyzing batch of {size} leads with Gemini (attempt {attempt + 1}/{attempts}): {e}")
+                continue
+            return {str(item.get("lead_id")): item for item in data if self._is_valid_analysis(item)}
+        raise GeminiUnavailable(f"Batch of {size} leads failed after {attempts} attempts: {error}")
+
+    @staticmethod
+    def _is_valid_analysis(item) -> bool:
+        if not isinstance(item, dict) or not isinstance(item.get("has_pain"), bool):
+            return False
+        if item["has_pain"]:
+            score = item.get("urgency_score")
+            return isinstance(score, int) and not isinstance(score, bool) and 0 <= score <= 10
+        return True
+
+    @staticmethod
+    def _apply_analysis(lead: Lead, data: dict):
+        lead.has_pain = data.get("has_pain", False)
+        if lead.has_pain:
+            lead.pain_category = data.get("pain_category")
+            lead.pain_summary = data.get("pain_summary")
+            lead.urgency_score = data.get("urgency_score", 0)
+            lead.notes = data.get("reasoning", "")
+
     async def draft_outreach(self, lead: Lead) -> str:
         if not lead.has_pain:
             return ""
 
-        prompt = f"""
-        Draft a very short (max 3 sentences), casual, non-salesy DM to this person.
-        Pretend you are a rough-around-the-edges founder (OpsPilot) who solves this exact pain.
-        
-        Context:
-        Their Pain: {lead.pain_summary}
-        Category: {lead.pain_category}
-        
-        Rules:
-        - No emojis.
-        - No links.
-        - No "I hope this finds you well".
-        - Just relate to the pain and offer a quick "same here" or "we fixed this by X".
-        - Sound valid, not spammy.
-        """
+        if self.cache:
+            cached = self.cache.get(DRAFT_VERSION, lead.post_excerpt)
+            if cached is not None:
+                return cached
+
+        prompt = DRAFT_PROMPT.format(pain_summary=lead.pain_summary, pain_category=lead.pain_category)
         
         try:
-            response = self.model.generate_content(prompt)
-            return response.text.strip()
+            response = await self.engine.generate(prompt)
+            draft = response.text.strip()
+            if self.cache and draft:
+                self.cache.put(DRAFT_VERSION, lead.post_excerpt, draft)
+            return draft
+        except BudgetExhausted:
+            raise
         except Exception as e:
             logger.error(f"Error drafting outreach: {e}")
             return ""
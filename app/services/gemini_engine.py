@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional
+from app.core import metrics, tracing
+from app.core.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+def is_quota_error(error: Exception) -> bool:
+    """True for 429 / ResourceExhausted style errors from the Gemini API."""
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    text = str(error).lower()
+    return "429" in text or "quota" in text or "resource exhausted" in text
+
+class GeminiUnavailable(Exception):
+    """A Gemini request failed for good: the leads should be retried next cycle, not dropped."""
+
+class BudgetExhausted(GeminiUnavailable):
+    """
+    Raised instead of calling Gemini once the cycle or daily budget is spent,
+    and when the API keeps answering 429 after every retry.
+    """
+
+class GeminiBudget:
+    """
+    Request and token budget per discovery cycle and per UTC day (0 = unlimited).
+    The daily counter lives in a SQLite file shared by every worker of the host
+    (the lease file): each call increments it atomically and check() re-reads
+    it, so runs moving between workers can't reset each other's count. Without
+    a path (tests) it is kept in memory. Calls already in flight when the
+    budget runs out still finish, so usage can overshoot by up to
+    GEMINI_MAX_CONCURRENCY requests per worker.
+    """
+    def __init__(self, path: Optional[str], cycle_requests: int = 0, cycle_tokens: int = 0, daily_requests: int = 0, daily_tokens: int = 0):
+        self.limits = {
+            "cycle": {"requests": cycle_requests, "tokens": cycle_tokens},
+            "daily": {"requests": daily_requests, "tokens": daily_tokens},
+        }
+        self.used = {"cycle": {"requests": 0, "tokens": 0}, "daily": {"requests": 0, "tokens": 0}}
+        self.day = self._today()
+        self.conn: Optional[sqlite3.Connection] = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS gemini_usage (
+                    day TEXT PRIMARY KEY,
+                    requests INTEGER NOT NULL,
+                    tokens INTEGER NOT NULL
+                )
+            """)
+            self.conn.execute("DELETE FROM gemini_usage WHERE day < ?", (self.day,))
+            self._refresh_daily()
+
+    def start_cycle(self):
+        self.used["cycle"] = {"requests": 0, "tokens": 0}
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.utcnow().date().isoformat()
+
+    def _refresh_daily(self):
+        """Pick up today's usage, including what other workers spent."""
+        self._roll_day()
+        if self.conn is None:
+            return
+        try:
+            row = self.conn.execute("SELECT requests, tokens FROM gemini_usage WHERE day = ?", (self.day,)).fetchone()
+            self.used["daily"] = {"requests": row[0], "tokens": row[1]} if row else {"requests": 0, "tokens": 0}
+        except sqlite3.Error as e:
+            # Keep the last known count rather than assuming nothing was spent
+            logger.error(f"Error reading Gemini usage: {e}")
+
+    def _roll_day(self):
+        if self.day != self._today():
+            self.day, self.used["daily"] = self._today(), {"requests": 0, "tokens": 0}
+
+    def check(self):
+        """Raise BudgetExhausted if any window has no requests or tokens left."""
+        self._refresh_daily()
+        for window, limits in self.limits.items():
+            for unit, limit in limits.items():
+                if limit and self.used[window][unit] >= limit:
+                    raise BudgetExhausted(f"Gemini {window} {unit} budget of {limit} used up")
+
+    def record(self, tokens: int):
+        self._roll_day()
+        self.used["cycle"]["requests"] += 1
+        self.used["cycle"]["tokens"] += tokens
+        if self.conn is None:
+            self.used["daily"]["requests"] += 1
+            self.used["daily"]["tokens"] += tokens
+        else:
+            try:
+                self.conn.execute("""
+                    INSERT INTO gemini_usage (day, requests, tokens) VALUES (?, 1, ?)
+                    ON CONFLICT (day) DO UPDATE SET requests = requests + 1, tokens = tokens + excluded.tokens
+                """, (self.day, tokens))
+            except sqlite3.Error as e:
+                logger.error(f"Error saving Gemini usage: {e}")
+            self._refresh_daily()
+        for window, used in self.used.items():
+            for unit, value in used.items():
+                metrics.GEMINI_BUDGET_USED.set(value, window=window, unit=unit)
+
+    def stats(self) -> dict:
+        self._refresh_daily()
+        return {
+            window: {
+                unit: {"used": self.used[window][unit], "limit": limit or None}
+                for unit, limit in limits.items()
+            }
+            for window, limits in self.limits.items()
+        }
+
+class GeminiEngine:
+    """
+    Runs Gemini calls on the event loop through the async generation API.
+    Caps in-flight requests, spends a requests-per-minute budget through a
+    token bucket, and backs off adaptively (AIMD) when the API returns 429s.
+    """
+    def __init__(self, model, max_concurrency: int = 4, requests_per_minute: float = 15, max_retries: int = 5, budget: Optional[GeminiBudget] = None):
+        self.model = model
+        self.max_retries = max_retries
+        self.budget = budget
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = TokenBucket(rate=requests_per_minute / 60.0, capacity=1.0)
+
+    @asynccontextmanager
+    async def _slot(self, attempt: int):
+        """A concurrency slot plus a rate-limit token; the wait for both is traced."""
+        with tracing.span("gemini.wait", attempt=attempt):
+            await self._semaphore.acquire()
+            try:
+                await self.rate_limiter.acquire()
+            except BaseException:
+                self._semaphore.release()
+                raise
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+    async def generate(self, prompt: str, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            # Don't queue for a slot and an RPM token just to find out the budget is gone
+            if self.budget is not None:
+                self.budget.check()
+            async with self._slot(attempt):
+                # Checked again after the waits, other calls may have spent the budget meanwhile
+                if self.budget is not None:
+                    self.budget.check()
+                started = time.perf_counter()
+                try:
+                    with tracing.span("gemini.call", attempt=attempt):
+                        response = await self.model.generate_content_async(prompt, **kwargs)
+                except Exception as e:
+                    quota_error = is_quota_error(e)
+                    metrics.GEMINI_REQUEST_SECONDS.observe(time.perf_counter() - started, outcome="error")
+                    metrics.GEMINI_ERRORS.inc(error=type(e).__name__)
+                    if quota_error:
+                        metrics.GEMINI_QUOTA_ERRORS.inc()
+                    if not quota_error:
+                        raise
+                    if attempt == self.max_retries:
+                        # Out of quota server-side: same as our own budget running
+                        # out, the callers defer the leads instead of dropping them
+                        raise BudgetExhausted(f"Gemini quota still exceeded after {attempt + 1} attempts: {e}") from e
+                    self._on_quota_error(attempt)
+                    continue
+                metrics.GEMINI_REQUEST_SECONDS.observe(time.perf_counter() - started, outcome="ok")
+
+            if self.budget is not None:
+                self.budget.record(self._token_count(prompt, response))
+            self._on_success()
+            return response
+
+    @staticmethod
+    def _token_count(prompt: str, response) -> int:
+        """Billed tokens from usage_metadata, else a rough 4 chars per token estimate."""
+        usage = getattr(response, "usage_metadata", None)
+        total = getattr(usage, "total_token_count", 0) if usage is not None else 0
+        if total:
+            return total
+        try:
+            text = response.text
+        except Exception:
+            text = ""
+        return (len(prompt) + len(text)) // 4
+
+    def _on_quota_error(self, attempt: int):
+        # Multiplicative decrease: halve the rate and pause everyone for an
+        # exponentially growing, jittered window.
+        self.rate_limiter.set_rate(self.rate_limiter.rate / 2)
+        delay = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+        logger.warning(
+            f"Gemini quota hit (attempt {attempt + 1}). Backing off {delay:.1f}s, "
+            f"rate now {self.rate_limiter.rate * 60:.1f} RPM"
+        )
+        self.rate_limiter.pause(delay)
+
+    def _on_success(self):
+        # Additive increase back towards the configured budget
+        limiter = self.rate_limiter
+        if limiter.rate < limiter.max_rate:
+            limiter.set_rate(limiter.rate + limiter.max_rate * 0.1)
@@ -0,0 +1,285 @@
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from collections import defaultdict
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
+from app.core.config import settings
+from app.models.lead import Lead
+from app.models.lead_batch import LeadBatch
+from app.models.lead_query import Cursor, LeadFilter, utc_iso
+
+logger = logging.getLogger(__name__)
+
+# Bound parameters per IN (...) lookup, well under SQLite's limit
+LOOKUP_CHUNK = 500
+
+# Persisted Lead fields, in column order
+LEAD_COLUMNS = [
+    "lead_id", "timestamp_utc", "platform", "author_handle", "author_profile_url",
+    "post_url", "post_excerpt", "has_pain", "pain_category", "pain_summary",
+    "urgency_score", "suggested_outreach_message", "lead_status", "notes", "last_updated_utc"
+]
+
+class LeadStore:
+    """
+    Embedded SQLite store holding every saved Lead. This is the primary write
+    path; Google Sheets is mirrored from it asynchronously (`synced_at` is NULL
+    until the row has been written to the sheet).
+    """
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self):
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS leads (
+                lead_id TEXT PRIMARY KEY,
+                timestamp_utc TEXT NOT NULL,
+                platform TEXT NOT NULL,
+                author_handle TEXT NOT NULL,
+                author_profile_url TEXT,
+                post_url TEXT NOT NULL,
+                post_excerpt TEXT NOT NULL,
+                has_pain INTEGER NOT NULL DEFAULT 0,
+                pain_category TEXT,
+                pain_summary TEXT,
+                urgency_score INTEGER NOT NULL DEFAULT 0,
+                suggested_outreach_message TEXT,
+                lead_status TEXT NOT NULL DEFAULT 'New',
+                notes TEXT,
+                last_updated_utc TEXT NOT NULL,
+                synced_at REAL
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_leads_post_url ON leads (post_url);
+            CREATE INDEX IF NOT EXISTS idx_leads_author ON leads (platform, author_handle);
+            CREATE INDEX IF NOT EXISTS idx_leads_urgency ON leads (urgency_score);
+            CREATE INDEX IF NOT EXISTS idx_leads_category ON leads (pain_category);
+            CREATE INDEX IF NOT EXISTS idx_leads_timestamp ON leads (timestamp_utc);
+            CREATE INDEX IF NOT EXISTS idx_leads_keyset ON leads (timestamp_utc, lead_id);  -- /leads pagination
+            CREATE INDEX IF NOT EXISTS idx_leads_updated ON leads (last_updated_utc);
+            CREATE INDEX IF NOT EXISTS idx_leads_unsynced ON leads (timestamp_utc) WHERE synced_at IS NULL;
+
+            -- Leads the Gemini budget could not cover, carried over to the next cycle
+            CREATE TABLE IF NOT EXISTS pending_leads (
+                lead_id TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                priority REAL NOT NULL,
+                discovered_at REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_pending_priority ON pending_leads (priority);
+        """)
+        self.conn.commit()
+
+    def is_duplicate(self, lead: Lead) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM leads WHERE post_url = ? OR (platform = ? AND author_handle = ?) LIMIT 1",
+            (lead.post_url, lead.platform, lead.author_handle)
+        ).fetchone()
+        return row is not None
+
+    def duplicate_rows(self, batch: LeadBatch) -> Set[int]:
+        """Rows of the batch already stored (same post URL or author), in a few indexed queries."""
+        urls = set(self._existing("SELECT post_url FROM leads WHERE post_url IN ({})", [], batch.post_url))
+
+        by_platform = defaultdict(set)
+        for platform, author in zip(batch.platform, batch.author_handle):
+            by_platform[platform].add(author)
+        authors = {
+            (platform, author)
+            for platform, handles in by_platform.items()
+            for author in self._existing(
+                "SELECT author_handle FROM leads WHERE platform = ? AND author_handle IN ({})", [platform], handles
+            )
+        }
+        return {
+            row for row, (url, platform, author) in enumerate(zip(batch.post_url, batch.platform, batch.author_handle))
+            if url in urls or (platform, author) in authors
+        }
+
+    def _existing(self, query: str, params: list, values: Iterable[str]) -> List[str]:
+        values = list(set(values))
+        found = []
+        for i in range(0, len(values), LOOKUP_CHUNK):
+            chunk = values[i:i + LOOKUP_CHUNK]
+            found.extend(row[0] for row in self.conn.execute(query.format(", ".join("?" * len(chunk))), params + chunk))
+        return found
+
+    def add(self, lead: Lead) -> bool:
+        """Insert a lead. Returns False if it is already stored."""
+        if self.is_duplicate(lead):
+            return False
+        values = [getattr(lead, column) for column in LEAD_COLUMNS]
+        try:
+            self.conn.execute(
+                f"INSERT INTO leads ({', '.join(LEAD_COLUMNS)}) VALUES ({', '.join('?' * len(LEAD_COLUMNS))})",
+                values
+            )
+            self.conn.commit()
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def unsynced(self, limit: int = 1000) -> List[Lead]:
+        rows = self.conn.execute(
+            f"SELECT {', '.join(LEAD_COLUMNS)} FROM leads WHERE synced_at IS NULL ORDER BY timestamp_utc LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [self.row_to_lead(row) for row in rows]
+
+    def mark_synced(self, lead_ids: Iterable[str]):
+        now = time.time()
+        self.conn.executemany(
+            "UPDATE leads SET synced_at = ? WHERE lead_id = ?", [(now, lead_id) for lead_id in lead_ids]
+        )
+        self.conn.commit()
+
+    def defer(self, leads: Iterable[Lead], stage: str, priority: Callable[[Lead], float]):
+        """Park leads that still need the given LLM stage ("analyze" or "draft")."""
+        rows = []
+        for lead in leads:
+            discovered = datetime.fromisoformat(lead.timestamp_utc).replace(tzinfo=timezone.utc).timestamp()
+            rows.append((lead.lead_id, stage, priority(lead), discovered, lead.model_dump_json()))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO pending_leads (lead_id, stage, priority, discovered_at, data) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        self.conn.commit()
+
+    def take_pending(self, limit: int, max_age_seconds: float) -> List[Tuple[str, Lead]]:
+        """
+        Remove and return up to `limit` deferred (stage, lead) pairs, best
+        priority first. Leads discovered more than `max_age_seconds` ago are dropped.
+        """
+        expired = self.conn.execute(
+            "DELETE FROM pending_leads WHERE discovered_at < ?", (time.time() - max_age_seconds,)
+        ).rowcount
+        if expired:
+            logger.info(f"Dropped {expired} deferred leads older than {max_age_seconds / 3600:.0f}h")
+
+        rows = self.conn.execute(
+            "SELECT lead_id, stage, data FROM pending_leads ORDER BY priority DESC LIMIT ?", (limit,)
+        ).fetchall()
+        self.conn.executemany("DELETE FROM pending_leads WHERE lead_id = ?", [(row["lead_id"],) for row in rows])
+        self.conn.commit()
+        return [(row["stage"], Lead.model_validate_json(row["data"])) for row in rows]
+
+    def pending_count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM pending_leads").fetchone()[0]
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM leads").fetchone()[0]
+
+    def summary(self) -> dict:
+        total, unsynced, avg_urgency = self.conn.execute(
+            "SELECT COUNT(*), COUNT(*) - COUNT(synced_at), AVG(urgency_score) FROM leads"
+        ).fetchone()
+        return {
+            "total": total,
+            "unsynced": unsynced,
+            "avg_urgency": round(avg_urgency or 0, 2),
+            "pending_llm": self.pending_count(),
+            "by_platform": dict(self.conn.execute("SELECT platform, COUNT(*) FROM leads GROUP BY platform").fetchall()),
+            "by_category": dict(self.conn.execute(
+                "SELECT COALESCE(pain_category, 'Unknown'), COUNT(*) FROM leads GROUP BY pain_category"
+            ).fetchall()),
+        }
+
+    def update_statuses(self, rows: Iterable[Tuple[str, str, str]]) -> int:
+        """
+        Apply (lead_id, lead_status, last_updated_utc) edited in the sheet.
+        last_updated_utc only ever comes from the sheet (a blank cell keeps the
+        stored value): stamping it here would differ from the sheet on the next
+        sync and flip back. Returns the number of leads changed.
+        """
+        changed = self.conn.executemany("""
+            UPDATE leads SET
+                lead_status = :status,
+                last_updated_utc = CASE WHEN :updated != '' THEN :updated ELSE last_updated_utc END
+            WHERE lead_id = :lead_id
+              AND (lead_status != :status OR (:updated != '' AND :updated != last_updated_utc))
+        """, [{"lead_id": lead_id, "status": status, "updated": updated} for lead_id, status, updated in rows]).rowcount
+        self.conn.commit()
+        return changed
+
+    @staticmethod
+    def _where(filters: LeadFilter, after: Optional[Cursor]) -> Tuple[str, list]:
+        clauses, params = [], []
+        for column, value in (
+            ("platform", filters.platform),
+            ("pain_category", filters.pain_category),
+            ("lead_status", filters.lead_status),
+        ):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if filters.min_urgency is not None:
+            clauses.append("urgency_score >= ?")
+            params.append(filters.min_urgency)
+        if filters.max_urgency is not None:
+            clauses.append("urgency_score <= ?")
+            params.append(filters.max_urgency)
+        if filters.since is not None:
+            clauses.append("timestamp_utc >= ?")
+            params.append(utc_iso(filters.since))
+        if filters.until is not None:
+            clauses.append("timestamp_utc < ?")
+            params.append(utc_iso(filters.until))
+        if after is not None:
+            # Keyset: strictly older than the last row of the previous page
+            clauses.append("(timestamp_utc, lead_id) < (?, ?)")
+            params.extend(after)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, filters: LeadFilter, limit: int, after: Optional[Cursor] = None, conn: Optional[sqlite3.Connection] = None) -> List[dict]:
+        """One page of persisted lead rows, newest first (ties broken by lead_id)."""
+        where, params = self._where(filters, after)
+        rows = (conn or self.conn).execute(
+            f"SELECT {', '.join(LEAD_COLUMNS)} FROM leads{where} ORDER BY timestamp_utc DESC, lead_id DESC LIMIT ?",
+            params + [limit]
+        ).fetchall()
+        return [self.row_to_dict(row) for row in rows]
+
+    def iter_query(self, filters: LeadFilter, after: Optional[Cursor] = None, page_size: int = 500) -> Iterator[dict]:
+        """
+        Every matching row, fetched page by page, so memory stays flat however
+        many leads match. Uses its own connection: exports are iterated from a
+        worker thread while the pipeline keeps writing through self.conn.
+        """
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        try:
+            while True:
+                page = self.query(filters, page_size, after, conn=conn)
+                yield from page
+                if len(page) < page_size:
+                    return
+                after = (page[-1]["timestamp_utc"], page[-1]["lead_id"])
+        finally:
+            conn.close()
+
+    @staticmethod
+    def row_to_dict(row) -> dict:
+        data = {column: row[column] for column in LEAD_COLUMNS}
+        data["has_pain"] = bool(data["has_pain"])
+        return data
+
+    @staticmethod
+    def row_to_lead(row) -> Lead:
+        data = {column: row[column] for column in LEAD_COLUMNS}
+        data["has_pain"] = bool(data["has_pain"])
+        return Lead(**data)
+
+    def close(self):
+        self.conn.close()
+
+def open_lead_store() -> LeadStore:
+    return LeadStore(os.path.join(settings.DATA_DIR, "leads.sqlite3"))
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from typing import Any, Optional
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+def normalize_text(text: str) -> str:
+    """Case and whitespace insensitive form of a post, so reposts hash the same."""
+    return re.sub(r"\s+", " ", (text or "").lower()).strip()
+
+def version_tag(*parts: str) -> str:
+    """Short digest of prompt templates + model name. Editing a prompt changes the tag."""
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()[:16]
+
+class LLMCache:
+    """
+    On-disk, content-addressed cache for parsed Gemini results, backed by SQLite.
+    Keys are sha256(kind version tag + normalized post text), entries expire
+    after `ttl_seconds` and the least recently used ones are evicted once the
+    table grows past `max_entries`.
+    """
+    EVICT_EVERY = 100  # puts between size checks
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._puts_since_evict = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+        self.conn.commit()
+        self._evict()
+
+    @staticmethod
+    def make_key(version: str, text: str) -> str:
+        return hashlib.sha256(f"{version}:{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get(self, version: str, text: str) -> Optional[Any]:
+        key = self.make_key(version, text)
+        row = self.conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+
+        if row is None or now - row[1] > self.ttl_seconds:
+            if row is not None:
+                self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.conn.commit()
+            self.misses += 1
+            metrics.LLM_CACHE_LOOKUPS.inc(result="miss")
+            return None
+
+        self.conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        self.conn.commit()
+        self.hits += 1
+        metrics.LLM_CACHE_LOOKUPS.inc(result="hit")
+        return json.loads(row[0])
+
+    def put(self, version: str, text: str, value: Any):
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (self.make_key(version, text), json.dumps(value), now, now)
+        )
+        self.conn.commit()
+
+        self._puts_since_evict += 1
+        if self._puts_since_evict >= self.EVICT_EVERY:
+            self._evict()
+
+    def _evict(self):
+        """Drop expired entries, then the least recently used ones above max_entries."""
+        self._puts_since_evict = 0
+        try:
+            expired = self.conn.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+            overflow = self.conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self.conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+                    (overflow,)
+                )
+            self.conn.commit()
+            self.evictions += expired + max(overflow, 0)
+        except sqlite3.Error as e:
+            logger.error(f"Error evicting LLM cache entries: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": self.conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        }
@@ -1,91 +1,378 @@
-import requests
-from typing import List, Optional, Dict, Any
+import asyncio
+import httpx
+from typing import AsyncIterator, List, NamedTuple, Optional, Dict, Any, Tuple
 from app.core.config import settings
+from app.core import tracing
+from app.core.keywords import get_matcher
+from app.core.rate_limit import TokenBucket
 from app.models.lead import Lead
+from app.models.lead_batch import LeadBatch
 import logging
+import json
+import os
 import time
 
 logger = logging.getLogger(__name__)
 
+class SubredditPoll(NamedTuple):
+    subreddit: str
+    batch: LeadBatch  # keyword matches only
+    cursor: Optional[Dict[str, Any]]  # new watermark, None if it should not move
+    failed: bool
+    posted: List[Optional[float]]  # created_utc of every new post, matching or not (cadence)
+
 class RedditService:
     """
     Read-only Reddit service using public JSON API.
     No authentication required - accesses public Reddit data.
+    All requests share one pooled keep-alive client and a token bucket,
+    so subreddits are fetched concurrently without blocking the event loop.
     """
     def __init__(self):
         self.base_url = "https://www.reddit.com"
         self.headers = {
             "User-Agent": settings.REDDIT_USER_AGENT
         }
-        self.last_request_time = 0
-        self.rate_limit_delay = 1.0  # 1 second between requests to be respectful
+        self.client: Optional[httpx.AsyncClient] = None
+        self.rate_limiter = TokenBucket(
+            rate=settings.REDDIT_REQUESTS_PER_SECOND,
+            capacity=max(1.0, settings.REDDIT_REQUESTS_PER_SECOND)
+        )
+        # Per-subreddit watermark: newest fullname and created_utc seen so far
+        self.cursors: Dict[str, Dict[str, Any]] = self._load_cursors()
+        # Last poll per subreddit: (new posts, hours they span or None), for the adaptive cadence
+        self.last_polls: Dict[str, Tuple[int, Optional[float]]] = {}
 
-    def _make_request(self, url: str) -> Optional[Dict[Any, Any]]:
-        """Make a rate-limited request to Reddit's JSON API."""
-        # Rate limiting: wait at least 1 second between requests
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        if time_since_last < self.rate_limit_delay:
-            time.sleep(self.rate_limit_delay - time_since_last)
-        
+    def _get_client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=10,
+                limits=httpx.Limits(max_connections=4, max_keepalive_connections=4)
+            )
+        return self.client
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def _apply_rate_limit_headers(self, headers: httpx.Headers):
+        """
+        Honor Reddit's x-ratelimit-* headers: spread the remaining budget over
+        the reset window, and pause entirely once it is used up.
+        """
         try:
-            response = requests.get(url, headers=self.headers, timeout=10)
-            self.last_request_time = time.time()
-            
-            if response.status_code == 200:
-                return response.json()
-            elif response.status_code == 429:
-                logger.warning("Rate limited by Reddit. Waiting 60 seconds...")
-                time.sleep(60)
-                return None
-            else:
-                logger.error(f"Reddit API returned status {response.status_code}")
+            remaining = float(headers["x-ratelimit-remaining"])
+            reset = float(headers["x-ratelimit-reset"])
+        except (KeyError, ValueError):
+            return
+
+        if remaining < 1:
+            logger.warning(f"Reddit rate limit budget exhausted. Pausing {reset:.0f}s...")
+            self.rate_limiter.pause(reset)
+        elif reset > 0:
+            self.rate_limiter.set_rate(remaining / reset)
+
+    async def _make_request(self, url: str) -> Optional[Dict[Any, Any]]:
+        """Make a rate-limited request to Reddit's JSON API."""
+        client = self._get_client()
+
+        for attempt in range(settings.REDDIT_MAX_RETRIES + 1):
+            with tracing.span("reddit.wait", attempt=attempt):
+                await self.rate_limiter.acquire()
+            try:
+                with tracing.span("reddit.request", attempt=attempt):
+                    response = await client.get(url)
+                self._apply_rate_limit_headers(response.headers)
+
+                if response.status_code == 200:
+                    return response.json()
+                elif response.status_code == 429:
+                    retry_after = float(
+                        response.headers.get("retry-after")
+                        or response.headers.get("x-ratelimit-reset")
+                        or 60
+                    )
+                    logger.warning(f"Rate limited by Reddit. Pausing requests for {retry_after:.0f} seconds...")
+                    self.rate_limiter.pause(retry_after)
+                    continue
+                else:
+                    logger.error(f"Reddit API returned status {response.status_code}")
+                    return None
+            except Exception as e:
+                logger.error(f"Error making request to Reddit: {e}")
                 return None
+
+        logger.error(f"Giving up on {url} after {settings.REDDIT_MAX_RETRIES} retries")
+        return None
+
+    def _cursor_path(self) -> str:
+        return os.path.join(settings.DATA_DIR, "reddit_cursors.json")
+
+    def _load_cursors(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self._cursor_path(), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.error(f"Error loading Reddit cursors, starting fresh: {e}")
+            return {}
+
+    def _save_cursors(self):
+        try:
+            os.makedirs(settings.DATA_DIR, exist_ok=True)
+            tmp_path = self._cursor_path() + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.cursors, f, indent=2)
+            os.replace(tmp_path, self._cursor_path())
         except Exception as e:
-            logger.error(f"Error making request to Reddit: {e}")
-            return None
+            logger.error(f"Error saving Reddit cursors: {e}")
 
-    def fetch_recent_posts(self, limit: int = 20) -> List[Lead]:
+    async def fetch_recent_posts(self, limit: int = 20, subreddits: Optional[List[str]] = None) -> List[Lead]:
+        """Keyword-matching posts as Leads (the workflow uses iter_recent_batches)."""
         leads = []
-        
-        # Fetch from each subreddit individually (JSON API limitation)
-        for subreddit in settings.SUBREDDITS:
-            logger.info(f"Scanning subreddit: r/{subreddit}")
-            url = f"{self.base_url}/r/{subreddit}/new.json?limit={limit}"
-            
-            data = self._make_request(url)
-            if not data:
-                continue
-            
-            try:
-                posts = data.get("data", {}).get("children", [])
-                for post_wrapper in posts:
-                    post = post_wrapper.get("data", {})
-                    
-                    # Basic pre-filter: check if relevant keywords exist
-                    full_text = f"{post.get('title', '')} {post.get('selftext', '')}"
-                    if self._basic_keyword_match(full_text):
-                        lead = self._post_to_lead(post)
-                        leads.append(lead)
-            except Exception as e:
-                logger.error(f"Error parsing Reddit data for r/{subreddit}: {e}")
-        
-        logger.info(f"Found {len(leads)} potential leads from Reddit")
+        async for batch in self.iter_recent_batches(limit, subreddits):
+            leads.extend(batch.to_leads())
         return leads
 
-    def _basic_keyword_match(self, text: str) -> bool:
-        text_lower = text.lower()
-        return any(keyword.lower() in text_lower for keyword in settings.KEYWORDS)
+    def _groups(self, subreddits: List[str]) -> List[List[str]]:
+        """Subreddits fetched together as one multireddit listing."""
+        size = settings.REDDIT_MULTIREDDIT_SIZE
+        if size <= 1:
+            return [[subreddit] for subreddit in subreddits]
+        return [subreddits[i:i + size] for i in range(0, len(subreddits), size)]
+
+    def _record_poll(self, subreddit: str, posted: List[Optional[float]], old_cursor: Optional[Dict[str, Any]], new_cursor: Optional[Dict[str, Any]]):
+        known = [t for t in posted if t is not None]
+        if old_cursor and (new_cursor or not known):
+            # Reached the watermark: every post since the last seen one
+            self.last_polls[subreddit] = (len(posted), (time.time() - old_cursor["created_utc"]) / 3600)
+        elif len(known) >= 2:
+            # First poll, or ran out of pages: the rate within what we got
+            self.last_polls[subreddit] = (len(known) - 1, (max(known) - min(known)) / 3600)
+        else:
+            self.last_polls[subreddit] = (len(posted), None)
+
+    async def iter_recent_batches(self, limit: int = 20, subreddits: Optional[List[str]] = None) -> AsyncIterator[LeadBatch]:
+        """
+        Yield each subreddit's keyword-matching new posts (a prefiltered
+        LeadBatch) as soon as that subreddit is fetched.
+        Subreddits are grouped into multireddit listings (/r/a+b+c/new.json),
+        so the request count grows with groups rather than subreddits. Groups
+        are fetched concurrently; the shared token bucket keeps us within Reddit's allowed rate.
+        `subreddits` restricts the poll (adaptive cadence), default all of SUBREDDITS.
+        """
+        self.last_polls = {}
+        tasks = [
+            asyncio.create_task(
+                self._fetch_group(group, limit) if len(group) > 1 else self._fetch_subreddit(group[0], limit)
+            )
+            for group in self._groups(subreddits if subreddits is not None else settings.SUBREDDITS)
+        ]
+        total = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                for poll in await next_done:
+                    total += len(poll.posted)
+                    yield poll.batch
+                    if not poll.failed:
+                        # A failed request says nothing about the post rate, and the
+                        # subreddit should stay due so the next tick retries it
+                        self._record_poll(poll.subreddit, poll.posted, self.cursors.get(poll.subreddit), poll.cursor)
+                    # Consumer took the posts, safe to move this subreddit's watermark
+                    if poll.cursor:
+                        self.cursors[poll.subreddit] = poll.cursor
+        finally:
+            for task in tasks:
+                task.cancel()
+            if settings.REDDIT_INCREMENTAL:
+                self._save_cursors()
 
-    def _post_to_lead(self, post: Dict[Any, Any]) -> Lead:
-        """Convert Reddit JSON post data to Lead object."""
+        logger.info(f"Found {total} new posts on Reddit")
+
+    async def _fetch_new_posts(self, subreddit: str, limit: int) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]], bool]:
+        """
+        Fetch posts newer than the subreddit's watermark, newest first, along
+        with the new watermark (None if it should not move) and whether a
+        request failed before the poll was complete.
+        Pages backwards with `after` and stops at the first already-seen post, so
+        work scales with new posts. Paging from the newest end (rather than with
+        `before=<watermark>`) keeps working when the watermark post is deleted.
+        Without a watermark (first run) only one page of `limit` posts is read.
+        """
+        cursor = self.cursors.get(subreddit) if settings.REDDIT_INCREMENTAL else None
+        page_size = 100 if cursor else limit
+        posts: List[Dict[str, Any]] = []
+        after = None
+        complete = False
+        failed = False
+
+        for _ in range(settings.REDDIT_MAX_PAGES):
+            url = f"{self.base_url}/r/{subreddit}/new.json?limit={page_size}"
+            if after:
+                url += f"&after={after}"
+
+            data = await self._make_request(url)
+            if not data:
+                failed = True
+                break
+
+            listing = data.get("data", {})
+            for post_wrapper in listing.get("children", []):
+                post = post_wrapper.get("data", {})
+                if cursor and (
+                    post.get("name") == cursor["fullname"]
+                    or post.get("created_utc", 0) <= cursor["created_utc"]
+                ):
+                    complete = True
+                    break
+                posts.append(post)
+
+            after = listing.get("after")
+            if complete or not after or cursor is None:
+                complete = True
+                break
+
+        if failed:
+            logger.warning(f"r/{subreddit}: request failed after {len(posts)} new posts, watermark not moved")
+        elif cursor and not complete:
+            logger.warning(f"r/{subreddit}: stopped after {settings.REDDIT_MAX_PAGES} pages before reaching the last seen post")
+
+        # Only move the watermark when we reached it, otherwise a failed page
+        # would leave a gap we never go back for.
+        new_cursor = None
+        if posts and (complete or cursor is None):
+            newest = posts[0]
+            new_cursor = {
+                "fullname": newest.get("name"),
+                "created_utc": newest.get("created_utc", 0),
+            }
+        return posts, new_cursor, failed
+
+    async def _fetch_group_posts(self, group: List[str], limit: int) -> Dict[str, Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]], bool]]:
+        """
+        Multireddit version of _fetch_new_posts: pages /r/a+b+c/new.json and
+        splits the posts back by their `subreddit` field.
+        The combined listing is sorted by creation time, so once a page reaches
+        posts older than a subreddit's watermark, that subreddit has nothing
+        newer left further down and is complete, even if its own watermark post
+        never shows up. Subreddits without a watermark are complete after `limit` posts.
+        A failed request marks every subreddit that wasn't complete yet as failed.
+        """
+        names = {subreddit.lower(): subreddit for subreddit in group}
+        cursors = {
+            subreddit: self.cursors.get(subreddit) if settings.REDDIT_INCREMENTAL else None
+            for subreddit in group
+        }
+        posts: Dict[str, List[Dict[str, Any]]] = {subreddit: [] for subreddit in group}
+        complete = set()
+        failed = set()
+        after = None
+
+        for _ in range(settings.REDDIT_MAX_PAGES):
+            url = f"{self.base_url}/r/{'+'.join(group)}/new.json?limit=100"
+            if after:
+                url += f"&after={after}"
+
+            data = await self._make_request(url)
+            if not data:
+                failed = set(group) - complete
+                break
+
+            listing = data.get("data", {})
+            for post_wrapper in listing.get("children", []):
+                post = post_wrapper.get("data", {})
+                created = post.get("created_utc", 0)
+                for subreddit, cursor in cursors.items():
+                    if cursor and created <= cursor["created_utc"]:
+                        complete.add(subreddit)
+
+                subreddit = names.get(str(post.get("subreddit", "")).lower())
+                if subreddit is None or subreddit in complete:
+                    continue
+                cursor = cursors[subreddit]
+                if cursor and post.get("name") == cursor["fullname"]:
+                    complete.add(subreddit)
+                    continue
+                posts[subreddit].append(post)
+                if cursor is None and len(posts[subreddit]) >= limit:
+                    complete.add(subreddit)
+
+            after = listing.get("after")
+            if len(complete) == len(group) or not after:
+                # An exhausted listing has nothing older left for anyone
+                if not after:
+                    complete.update(group)
+                break
+
+        results = {}
+        for subreddit in group:
+            sub_posts, cursor = posts[subreddit], cursors[subreddit]
+            if subreddit in failed:
+                logger.warning(f"r/{subreddit}: multireddit request failed after {len(sub_posts)} new posts, watermark not moved")
+            elif cursor and subreddit not in complete:
+                logger.warning(f"r/{subreddit}: stopped after {settings.REDDIT_MAX_PAGES} pages before reaching the last seen post")
+            # Same rule as single listings: only move a watermark we reached
+            new_cursor = None
+            if sub_posts and (subreddit in complete or cursor is None):
+                new_cursor = {
+                    "fullname": sub_posts[0].get("name"),
+                    "created_utc": sub_posts[0].get("created_utc", 0),
+                }
+            results[subreddit] = (sub_posts, new_cursor, subreddit in failed)
+        return results
+
+    async def _fetch_group(self, group: List[str], limit: int) -> List[SubredditPoll]:
+        logger.info(f"Scanning multireddit: r/{'+'.join(group)}")
+        results = await self._fetch_group_posts(group, limit)
+        return [
+            SubredditPoll(subreddit, self._to_batch(subreddit, posts), cursor, failed, [post.get("created_utc") for post in posts])
+            for subreddit, (posts, cursor, failed) in results.items()
+        ]
+
+    async def _fetch_subreddit(self, subreddit: str, limit: int) -> List[SubredditPoll]:
+        logger.info(f"Scanning subreddit: r/{subreddit}")
+        posts, cursor, failed = await self._fetch_new_posts(subreddit, limit)
+        return [SubredditPoll(subreddit, self._to_batch(subreddit, posts), cursor, failed, [post.get("created_utc") for post in posts])]
+
+    @staticmethod
+    def _excerpt(post: Dict[Any, Any]) -> str:
+        return f"{post.get('title', '')}\n\n{post.get('selftext', '')}"[:1000]
+
+    def _to_batch(self, subreddit: str, posts: List[Dict[str, Any]]) -> LeadBatch:
+        # Keyword-match the whole listing in one pass (the same score_many the
+        # workflow's prefilter uses) and only append the matches: most posts
+        # don't match, and they never need to travel down the pipeline.
+        batch = LeadBatch()
+        batch.prefiltered = True
+        try:
+            excerpts = [self._excerpt(post) for post in posts]
+            scores, terms = get_matcher().score_many(excerpts)
+            for post, excerpt, score, matched in zip(posts, excerpts, scores, terms):
+                if score >= settings.MIN_RELEVANCE_SCORE:
+                    self._append_post(batch, post, excerpt, score, matched)
+            batch.low_relevance = len(posts) - len(batch)
+        except Exception as e:
+            logger.error(f"Error parsing Reddit data for r/{subreddit}: {e}")
+        logger.info(f"r/{subreddit}: {len(posts)} new posts, {len(batch)} matching keywords")
+        return batch
+
+    def _append_post(self, batch: LeadBatch, post: Dict[Any, Any], excerpt: str, score: float, matched: List[str]):
+        """Add Reddit JSON post data to the batch."""
         author = post.get("author", "[deleted]")
         permalink = post.get("permalink", "")
-        
-        return Lead(
+
+        batch.append(
             platform="Reddit",
             author_handle=author,
             post_url=f"https://www.reddit.com{permalink}",
-            post_excerpt=f"{post.get('title', '')}\n\n{post.get('selftext', '')}"[:1000],
-            author_profile_url=f"https://www.reddit.com/user/{author}" if author != "[deleted]" else None
+            post_excerpt=excerpt,
+            author_profile_url=f"https://www.reddit.com/user/{author}" if author != "[deleted]" else None,
+            posted_utc=post.get("created_utc"),
+            upvotes=post.get("ups") or 0,
+            comments=post.get("num_comments") or 0,
+            relevance_score=score,
+            matched_keywords=matched
         )
@@ -1,23 +1,83 @@
 import gspread
+from gspread.utils import rowcol_to_a1
 from oauth2client.service_account import ServiceAccountCredentials
 from app.core.config import settings
+from app.core import metrics, tracing
 from app.models.lead import Lead
+from app.models.lead_batch import LeadBatch
+from app.services.lead_store import LeadStore
 import logging
 import json
-from typing import Set, Tuple, List
+import hashlib
+from typing import Set, Tuple, List, Optional
+import asyncio
 import os
+import time
 
 logger = logging.getLogger(__name__)
 
+HEADERS = [
+    "lead_id", "timestamp_utc", "platform", "author_handle", 
+    "author_profile_url", "post_url", "post_excerpt", 
+    "pain_summary", "pain_category", "urgency_score", 
+    "suggested_outreach_message", "lead_status", "notes", "last_updated_utc"
+]
+
+# The only columns the dedup cache needs
+DEDUP_COLUMNS = ["platform", "author_handle", "post_url"]
+
+# Edited by hand in the sheet, read back into the lead store every SHEETS_STATUS_SYNC_MINUTES (all rows)
+STATUS_COLUMNS = ["lead_id", "lead_status", "last_updated_utc"]
+
+def column_letter(col: int) -> str:
+    return rowcol_to_a1(1, col)[:-1]
+
+def _first_cell(values) -> str:
+    return str(values[0][0]) if values and values[0] else ""
+
+def _cell(column, i: int) -> str:
+    # Depending on how gspread returns data (int/str), ensure string matching
+    return str(column[i][0]) if i < len(column) and column[i] else ""
+
 class SheetsService:
-    def __init__(self):
+    """
+    Google Sheets mirror of the local LeadStore. Rows are written behind the
+    workflow in batches and marked as synced in the store once they land.
+    Long-lived: it authorizes once, and each cycle calls refresh() to pick up
+    rows added to the sheet since the last one.
+    """
+    def __init__(self, store: Optional[LeadStore] = None):
+        self.store = store
         self.scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
         self.client = None
         self.sheet = None
         self.existing_urls: Set[str] = set()
         self.existing_authors: Set[Tuple[str, str]] = set() # (platform, handle)
+        # (lead_id, lead_status, last_updated_utc) read by refresh(), applied by sync_statuses()
+        self.sheet_statuses: List[Tuple[str, str, str]] = []
+        self.header: List[str] = []  # as of the last dedup load
+        self._statuses_read_at: Optional[float] = None  # time.monotonic()
 
-        self._connect()
+        # Write-behind buffer, flushed with one append_rows call
+        self._buffer: List[Lead] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None  # interval timer
+        self._size_flush: Optional[asyncio.Task] = None  # flush started by a full batch
+        # A flush gave up: its last attempt may still have landed server-side
+        self._maybe_written = False
+
+    def refresh(self):
+        """
+        Start-of-cycle sync (blocking, run in a worker thread): connect if
+        needed, update the dedup keys and, when due, read the lead statuses.
+        Sheet-side only; the lead store part (requeue_unsynced, sync_statuses)
+        runs on the event loop, which shares its connection.
+        """
+        if not self.sheet:
+            self._connect()
+        self._load_deduplication_cache()
+        if self._statuses_due():
+            self._load_statuses()
 
     def _connect(self):
         try:
@@ -43,40 +103,162 @@ class SheetsService:
                 sh.share(creds.service_account_email, perm_type='user', role='owner') # Technically the service account owns it
                 self.sheet = sh.sheet1
                 # Initialize headers if new
-                self.sheet.append_row([
-                    "lead_id", "timestamp_utc", "platform", "author_handle", 
-                    "author_profile_url", "post_url", "post_excerpt", 
-                    "pain_summary", "pain_category", "urgency_score", 
-                    "suggested_outreach_message", "lead_status", "notes", "last_updated_utc"
-                ])
-                
-            self._load_deduplication_cache()
+                self.sheet.append_row(HEADERS)
             
         except Exception as e:
             logger.error(f"Failed to connect to Google Sheets: {e}")
 
-    def _load_deduplication_cache(self):
-        """Pre-fetch existing keys to avoid duplicates."""
+    def _state_path(self) -> str:
+        return os.path.join(settings.DATA_DIR, "dedup_state.json")
+
+    @staticmethod
+    def _keys_checksum(urls, authors) -> str:
+        digest = hashlib.sha256()
+        for url in sorted(urls):
+            digest.update(url.encode("utf-8") + b"\n")
+        for platform, handle in sorted(authors):
+            digest.update(f"{platform}\t{handle}".encode("utf-8") + b"\n")
+        return digest.hexdigest()
+
+    def _read_state(self) -> Optional[dict]:
+        """Load the persisted key set. Any mismatch means we can't trust it."""
+        try:
+            with open(self._state_path(), encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Unreadable dedup state, doing a full rescan: {e}")
+            return None
+
+        urls = set(state.get("urls", []))
+        authors = {tuple(a) for a in state.get("authors", [])}
+        if state.get("sheet_key") != self._sheet_key():
+            logger.info("Dedup state belongs to a different sheet, doing a full rescan.")
+            return None
+        if state.get("checksum") != self._keys_checksum(urls, authors):
+            logger.warning("Dedup state checksum mismatch, doing a full rescan.")
+            return None
+
+        state["urls"] = urls
+        state["authors"] = authors
+        return state
+
+    def _write_state(self, row_count: int, anchor: str, header: List[str]):
+        try:
+            os.makedirs(settings.DATA_DIR, exist_ok=True)
+            tmp_path = self._state_path() + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "sheet_key": self._sheet_key(),
+                    "header": header,
+                    "row_count": row_count,
+                    "anchor": anchor,
+                    "checksum": self._keys_checksum(self.existing_urls, self.existing_authors),
+                    "urls": sorted(self.existing_urls),
+                    "authors": sorted(self.existing_authors),
+                }, f)
+            os.replace(tmp_path, self._state_path())
+        except Exception as e:
+            logger.error(f"Error saving dedup state: {e}")
+
+    def _sheet_key(self) -> str:
+        return f"{self.sheet.spreadsheet.id}/{self.sheet.id}"
+
+    def rescan_dedup_cache(self):
+        """Drop the persisted key set and rebuild it from the whole sheet (on demand)."""
+        self._load_deduplication_cache(full=True)
+
+    def _load_deduplication_cache(self, full: bool = False):
+        """
+        Pre-fetch existing keys to avoid duplicates.
+        Only the platform, author_handle and post_url columns are downloaded, and
+        only for rows appended since the last cycle. The key set and last-seen
+        row count persist in DATA_DIR; a full rescan happens on demand or when
+        the persisted state no longer matches the sheet.
+        """
         if not self.sheet:
             return
         
         try:
-            records = self.sheet.get_all_records()
-            for row in records:
-                # Depending on how gspread returns data (int/str), ensure string matching
-                p_url = str(row.get('post_url', ''))
-                platform = str(row.get('platform', ''))
-                handle = str(row.get('author_handle', ''))
-                
+            state = None if (full or settings.DEDUP_FULL_RESCAN) else self._read_state()
+            if state is None:
+                self.existing_urls.clear()
+                self.existing_authors.clear()
+                header = self.sheet.row_values(1) or HEADERS
+                row_count = 1  # header row
+            else:
+                self.existing_urls.update(state["urls"])
+                self.existing_authors.update(state["authors"])
+                header = state["header"]
+                row_count = state["row_count"]
+
+            try:
+                cols = [header.index(name) + 1 for name in DEDUP_COLUMNS]
+            except ValueError:
+                logger.error(f"Sheet header is missing one of {DEDUP_COLUMNS}, cannot load dedup cache.")
+                return
+
+            # One request: header (to detect edits), the last row we saw (anchor)
+            # and the three key columns from the first unseen row onwards.
+            start = row_count + 1
+            url_col = cols[DEDUP_COLUMNS.index("post_url")]
+            ranges = ["1:1", rowcol_to_a1(row_count, url_col)] + [
+                f"{column_letter(col)}{start}:{column_letter(col)}" for col in cols
+            ]
+            header_values, anchor_values, *columns = self.sheet.batch_get(ranges)
+
+            current_header = header_values[0] if header_values else []
+            anchor = _first_cell(anchor_values)
+            if state is not None and (current_header != header or anchor != state.get("anchor", "")):
+                logger.warning("Sheet changed since the last cycle (header or anchor row mismatch), doing a full rescan.")
+                return self._load_deduplication_cache(full=True)
+
+            new_rows = max((len(column) for column in columns), default=0)
+            for i in range(new_rows):
+                platform, handle, p_url = (_cell(column, i) for column in columns)
                 if p_url:
                     self.existing_urls.add(p_url)
                 if platform and handle:
                     self.existing_authors.add((platform, handle))
-            
-            logger.info(f"Loaded deduplication cache: {len(self.existing_urls)} URLs, {len(self.existing_authors)} Authors.")
+
+            if new_rows:
+                row_count += new_rows
+                url_values = columns[DEDUP_COLUMNS.index("post_url")]
+                anchor = _first_cell(url_values[new_rows - 1:])
+            self.header = current_header or header
+            self._write_state(row_count, anchor, self.header)
+
+            logger.info(f"Loaded deduplication cache: {len(self.existing_urls)} URLs, {len(self.existing_authors)} Authors ({new_rows} new rows).")
         except Exception as e:
             logger.error(f"Error loading cache: {e}")
 
+    def _statuses_due(self) -> bool:
+        if settings.SHEETS_STATUS_SYNC_MINUTES <= 0 or not self.header:
+            return False
+        return self._statuses_read_at is None or time.monotonic() - self._statuses_read_at >= settings.SHEETS_STATUS_SYNC_MINUTES * 60
+
+    def _load_statuses(self):
+        """
+        Read STATUS_COLUMNS for every row, for sync_statuses. Statuses are
+        edited on old rows too, so this can't be incremental like the dedup
+        keys; its own interval keeps the cost off most cycles.
+        """
+        if not all(name in self.header for name in STATUS_COLUMNS):
+            return
+        self._statuses_read_at = time.monotonic()
+        try:
+            ranges = [f"{column_letter(col)}2:{column_letter(col)}" for col in (self.header.index(name) + 1 for name in STATUS_COLUMNS)]
+            columns = self.sheet.batch_get(ranges)
+            self.sheet_statuses = []
+            for i in range(max((len(column) for column in columns), default=0)):
+                lead_id, status, updated = (_cell(column, i) for column in columns)
+                if lead_id and status:
+                    self.sheet_statuses.append((lead_id, status, updated))
+            logger.info(f"Read {len(self.sheet_statuses)} lead statuses from Google Sheets")
+        except Exception as e:
+            logger.error(f"Error reading lead statuses: {e}")
+
     def is_duplicate(self, lead: Lead) -> bool:
         if lead.post_url in self.existing_urls:
             return True
@@ -84,7 +266,38 @@ class SheetsService:
             return True
         return False
 
-    def append_lead(self, lead: Lead) -> bool:
+    def duplicate_rows(self, batch: LeadBatch) -> Set[int]:
+        """Rows of the batch already in the sheet (same post URL or author)."""
+        return {
+            row for row, (url, platform, author) in enumerate(zip(batch.post_url, batch.platform, batch.author_handle))
+            if url in self.existing_urls or (platform, author) in self.existing_authors
+        }
+
+    @staticmethod
+    def _lead_to_row(lead: Lead) -> list:
+        return [
+            lead.lead_id,
+            lead.timestamp_utc,
+            lead.platform,
+            lead.author_handle,
+            lead.author_profile_url,
+            lead.post_url,
+            lead.post_excerpt,
+            lead.pain_summary,
+            lead.pain_category,
+            lead.urgency_score,
+            lead.suggested_outreach_message,
+            lead.lead_status,
+            lead.notes,
+            lead.last_updated_utc
+        ]
+
+    async def append_lead(self, lead: Lead) -> bool:
+        """
+        Queue a lead for the write-behind buffer. Rows are written with a single
+        append_rows call once SHEETS_BATCH_SIZE rows are pending or
+        SHEETS_FLUSH_INTERVAL_SECONDS have passed, whichever comes first.
+        """
         if not self.sheet:
             return False
             
@@ -92,33 +305,136 @@ class SheetsService:
             logger.info(f"Skipping duplicate: {lead.platform} - {lead.author_handle}")
             return False
 
+        self._buffer.append(lead)
+
+        # Update cache now so later leads in this cycle dedup against it
+        self.existing_urls.add(lead.post_url)
+        self.existing_authors.add((lead.platform, lead.author_handle))
+
+        if len(self._buffer) >= settings.SHEETS_BATCH_SIZE:
+            # In the background: the persist stage never waits on the Sheets API
+            if self._size_flush is None or self._size_flush.done():
+                self._size_flush = asyncio.create_task(self._flush_full())
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+        return True
+
+    async def _flush_full(self):
+        # Rows keep arriving while a batch is written; keep going while a full one is pending
+        while len(self._buffer) >= settings.SHEETS_BATCH_SIZE:
+            if not await self.flush():
+                break
+
+    async def _flush_later(self):
         try:
-            row = [
-                lead.lead_id,
-                lead.timestamp_utc,
-                lead.platform,
-                lead.author_handle,
-                lead.author_profile_url,
-                lead.post_url,
-                lead.post_excerpt,
-                lead.pain_summary,
-                lead.pain_category,
-                lead.urgency_score,
-                lead.suggested_outreach_message,
-                lead.lead_status,
-                lead.notes,
-                lead.last_updated_utc
-            ]
-            self.sheet.append_row(row)
-            
-            # Update cache
+            await asyncio.sleep(settings.SHEETS_FLUSH_INTERVAL_SECONDS)
+            await self.flush()
+        finally:
+            self._flush_task = None
+
+    async def flush(self) -> int:
+        """Write every buffered row. Returns the number of rows written."""
+        async with self._flush_lock:
+            if not self._buffer or not self.sheet:
+                return 0
+
+            batch = list(self._buffer)
+            if not await self._write_rows(batch, verify_first=self._maybe_written):
+                self._maybe_written = True
+                logger.error(f"{len(self._buffer)} rows still pending for Google Sheets, will retry on next flush")
+                return 0
+            self._maybe_written = False
+
+            # Rows queued while we were writing stay in the buffer
+            del self._buffer[:len(batch)]
+            if self.store:
+                self.store.mark_synced(lead.lead_id for lead in batch)
+            return len(batch)
+
+    async def close(self):
+        """Cancel the timer, wait for a background flush and flush whatever is left (end of cycle)."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._size_flush is not None:
+            await self._size_flush
+            self._size_flush = None
+        await self.flush()
+        if self._buffer:
+            # Still unsynced in the lead store, re-queued by the next run
+            logger.warning(f"{len(self._buffer)} rows could not be mirrored to Google Sheets this cycle")
+
+    async def _write_rows(self, batch: List[Lead], verify_first: bool = False) -> bool:
+        """`verify_first`: an earlier flush of these rows failed, check before the first attempt too."""
+        pending = batch
+        for attempt in range(settings.SHEETS_MAX_RETRIES + 1):
+            if attempt > 0 or verify_first:
+                # A failed call may still have landed server-side (e.g. timeout after
+                # the write). Check the lead_id column so retries never double-write.
+                try:
+                    written_ids = set(await asyncio.to_thread(self.sheet.col_values, 1))
+                    pending = [lead for lead in pending if lead.lead_id not in written_ids]
+                except Exception as e:
+                    # Can't tell what landed, so don't write blind
+                    logger.error(f"Error checking written rows before retry: {e}")
+                    if attempt < settings.SHEETS_MAX_RETRIES:
+                        await asyncio.sleep(min(60, 2 ** attempt))
+                    continue
+                if not pending:
+                    return True
+
+            started = time.perf_counter()
+            try:
+                rows = [self._lead_to_row(lead) for lead in pending]
+                with tracing.span("sheets.write", pending, attempt=attempt):
+                    await asyncio.to_thread(self.sheet.append_rows, rows, value_input_option="RAW")
+                metrics.SHEETS_WRITE_SECONDS.observe(time.perf_counter() - started, outcome="ok")
+                metrics.SHEETS_BATCH_ROWS.observe(len(rows))
+                logger.info(f"Wrote {len(rows)} rows to Google Sheets")
+                return True
+            except Exception as e:
+                metrics.SHEETS_WRITE_SECONDS.observe(time.perf_counter() - started, outcome="error")
+                error_str = str(e)
+                if "storageQuotaExceeded" in error_str:
+                    logger.error("CRITICAL: Google Drive storage quota exceeded. Cannot save lead. Please free up space in the connected Google Drive account.")
+                    return False
+                logger.error(f"Error writing to Sheet (attempt {attempt + 1}): {e}")
+                if attempt < settings.SHEETS_MAX_RETRIES:
+                    await asyncio.sleep(min(60, 2 ** attempt))
+        return False
+
+    def sync_statuses(self):
+        """Apply the lead statuses read by refresh() to the lead store, so /leads can filter on them."""
+        if not self.store or not self.sheet_statuses:
+            return
+        try:
+            changed = self.store.update_statuses(self.sheet_statuses)
+            if changed:
+                logger.info(f"Synced {changed} lead status edits from Google Sheets")
+        except Exception as e:
+            logger.error(f"Error syncing lead statuses from Google Sheets: {e}")
+        self.sheet_statuses = []
+
+    def requeue_unsynced(self):
+        """Queue rows the lead store has not mirrored yet (e.g. a previous flush failed)."""
+        if not self.store:
+            return
+
+        already_written = []
+        buffered = {lead.lead_id for lead in self._buffer}
+        for lead in self.store.unsynced(limit=100000):
+            if lead.lead_id in buffered:
+                # Left over from a failed flush last cycle, still queued
+                continue
+            if lead.post_url in self.existing_urls:
+                # Landed in the sheet but was never marked, don't write it twice
+                already_written.append(lead.lead_id)
+                continue
+            self._buffer.append(lead)
             self.existing_urls.add(lead.post_url)
             self.existing_authors.add((lead.platform, lead.author_handle))
-            return True
-        except Exception as e:
-            error_str = str(e)
-            if "storageQuotaExceeded" in error_str:
-                logger.error("CRITICAL: Google Drive storage quota exceeded. Cannot save lead. Please free up space in the connected Google Drive account.")
-            else:
-                logger.error(f"Error writing to Sheet: {e}")
-            return False
+
+        if already_written:
+            self.store.mark_synced(already_written)
+        if len(self._buffer) > len(buffered):
+            logger.info(f"Re-queued {len(self._buffer) - len(buffered)} unsynced rows from the lead store")
@@ -1,9 +1,13 @@
 import logging
 import asyncio
-import random
-from typing import List
+import math
+import os
+import time
+from typing import Dict, List
 from twikit import Client
+from twikit.errors import TooManyRequests, Unauthorized
 from app.core.config import settings
+from app.core.rate_limit import TokenBucket
 from app.models.lead import Lead
 
 logger = logging.getLogger(__name__)
@@ -12,6 +16,14 @@ class TwitterService:
     def __init__(self):
         self.client = None
         self.enabled = False # Explicitly disabled by user request
+        self.authenticated = False
+        self.cookies_path = os.path.join(settings.DATA_DIR, "twitter_cookies.json")
+        # Replaces the fixed 5-10s random sleep: paced to the search rate limit,
+        # and paused until x-rate-limit-reset when X returns a 429.
+        self.rate_limiter = TokenBucket(
+            rate=settings.TWITTER_REQUESTS_PER_MINUTE / 60.0,
+            capacity=max(1.0, settings.TWITTER_MAX_CONCURRENT_QUERIES)
+        )
 
         if settings.TWITTER_USERNAME and settings.TWITTER_PASSWORD:
             self.client = Client('en-US')
@@ -19,20 +31,36 @@ class TwitterService:
         else:
             logger.info("Twitter credentials not provided. Service disabled.")
 
-    async def _authenticate(self):
+    async def _authenticate(self, force: bool = False):
+        """
+        Reuse the saved session cookies; only do a full login when there are
+        none or X rejected them (`force`). Frequent logins can trigger security locks.
+        """
         if not self.enabled:
             return False
-        
+        if self.authenticated and not force:
+            return True
+
+        if not force and os.path.exists(self.cookies_path):
+            try:
+                self.client.load_cookies(self.cookies_path)
+                self.authenticated = True
+                logger.info("Twitter session restored from saved cookies.")
+                return True
+            except Exception as e:
+                logger.warning(f"Could not load Twitter cookies, logging in again: {e}")
+
         try:
             # Twikit requires async login
-            # Note: 2FA or email challenges might occur. 
-            # Ideally cookies should be saved/loaded to avoid repetitive logins, 
-            # but for MVP we attempt fresh login.
+            # Note: 2FA or email challenges might occur.
             await self.client.login(
                 auth_info_1=settings.TWITTER_USERNAME,
                 auth_info_2=settings.TWITTER_EMAIL,
                 password=settings.TWITTER_PASSWORD
             )
+            os.makedirs(settings.DATA_DIR, exist_ok=True)
+            self.client.save_cookies(self.cookies_path)
+            self.authenticated = True
             logger.info("Twitter authenticated successfully.")
             return True
         except Exception as e:
@@ -40,49 +68,89 @@ class TwitterService:
             self.enabled = False
             return False
 
+    async def _request(self, fetch, *args, **kwargs):
+        """Rate-limited call that re-logs in once on an auth failure and waits out 429s."""
+        relogged = False
+        for attempt in range(settings.TWITTER_MAX_RETRIES + 1):
+            await self.rate_limiter.acquire()
+            try:
+                return await fetch(*args, **kwargs)
+            except Unauthorized:
+                if relogged or not await self._authenticate(force=True):
+                    raise
+                relogged = True
+            except TooManyRequests as e:
+                if attempt == settings.TWITTER_MAX_RETRIES:
+                    raise
+                wait = max(1.0, e.rate_limit_reset - time.time()) if e.rate_limit_reset else 60.0
+                logger.warning(f"Rate limited by X. Pausing searches for {wait:.0f}s...")
+                self.rate_limiter.pause(wait)
+        raise RuntimeError("X request retries exhausted")
+
+    def _queries(self) -> List[str]:
+        """Spread every configured keyword across several OR queries."""
+        size = max(1, settings.TWITTER_KEYWORDS_PER_QUERY)
+        groups = [settings.KEYWORDS[i:i + size] for i in range(0, len(settings.KEYWORDS), size)]
+        # Twikit search syntax similar to web: "keyword1 OR keyword2"
+        return [f"({' OR '.join(group)}) -filter:retweets" for group in groups]
+
+    async def _search(self, query: str, target: int) -> list:
+        """Follow the search cursor until `target` tweets or the results run out."""
+        logger.info(f"Searching X for: {query[:50]}...")
+        tweets = []
+        page = await self._request(self.client.search_tweet, query, 'Latest', count=min(20, target))
+        while True:
+            tweets.extend(page)
+            if len(tweets) >= target or not page.next_cursor or len(page) == 0:
+                break
+            page = await self._request(page.next)
+        return tweets[:target]
+
     async def fetch_recent_posts(self, limit: int = 20) -> List[Lead]:
         if not self.enabled:
             return []
 
-        # Authenticate if needed (simple check)
-        # In a real app we'd verify cookie validity
-        try:
-            # We assume session might need init. 
-            # Warning: Frequent logins can trigger security locks.
-            # A robust implementation would load cookies.json
-            await self._authenticate()
-        except Exception:
+        if not await self._authenticate():
             return []
 
         leads = []
         try:
-            # Search query construction
-            # Twikit search syntax similar to web: "keyword1 OR keyword2"
-            # We'll take top 5 keywords to avoid query complexity issues
-            query_keywords = " OR ".join(settings.KEYWORDS[:5])
-            query = f"({query_keywords}) -filter:retweets"
-            
-            logger.info(f"Searching X for: {query[:50]}...")
-            
-            tweets = await self.client.search_tweet(query, 'Latest', count=limit)
-            
-            for tweet in tweets:
-                leads.append(self._tweet_to_lead(tweet))
-                
-            # Random delay to be safe
-            await asyncio.sleep(random.uniform(5, 10))
-            
+            queries = self._queries()
+            target = math.ceil(limit / len(queries))
+            semaphore = asyncio.Semaphore(settings.TWITTER_MAX_CONCURRENT_QUERIES)
+
+            async def run_query(query: str) -> list:
+                async with semaphore:
+                    try:
+                        return await self._search(query, target)
+                    except Exception as e:
+                        logger.error(f"Error searching X for {query[:50]}: {e}")
+                        return []
+
+            results = await asyncio.gather(*(run_query(query) for query in queries))
+
+            # The same tweet can match several keyword groups
+            seen: Dict[str, object] = {}
+            for tweets in results:
+                for tweet in tweets:
+                    seen.setdefault(tweet.id, tweet)
+            leads = [self._tweet_to_lead(tweet) for tweet in list(seen.values())[:limit]]
+
         except Exception as e:
             logger.error(f"Error fetching from Twitter: {e}")
 
         return leads
 
     def _tweet_to_lead(self, tweet) -> Lead:
+        created = getattr(tweet, "created_at_datetime", None)
         return Lead(
             platform="X",
             author_handle=tweet.user.screen_name,
             post_url=f"https://x.com/{tweet.user.screen_name}/status/{tweet.id}",
             post_excerpt=tweet.text[:1000],
             author_profile_url=f"https://x.com/{tweet.user.screen_name}",
-            has_pain=False
+            has_pain=False,
+            posted_utc=created.timestamp() if created else None,
+            upvotes=getattr(tweet, "favorite_count", 0) or 0,
+            comments=getattr(tweet, "reply_count", 0) or 0
         )
@@ -0,0 +1,460 @@
+"""
+Offline benchmark for run_discovery_cycle.
+
+Runs the real pipeline against local stand-ins: a fake Reddit JSON server
+(separate process, configurable latency / 429s / corpus size), a fake Gemini
+model (latency distribution, quota errors) and an in-memory worksheet behind
+the real SheetsService write path. Reports cycle time, per-stage latency
+percentiles, LLM calls per saved lead and peak traced memory, plus the cold
+start time of the app (importing app.main in a fresh interpreter).
+
+    python benchmark_workflow.py --sizes 100,1000,10000,100000 --json bench.json
+
+Save the JSON per commit to compare runs.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+# Mock env vars BEFORE app imports (which trigger Settings load)
+with patch.dict('os.environ', {
+    'GEMINI_API_KEY': 'bench_key',
+    'GOOGLE_SERVICE_ACCOUNT_JSON': 'bench.json',
+    'DATA_DIR': tempfile.mkdtemp(prefix="opspilot-bench-")
+}):
+    from app.core.config import settings
+    from app.core import metrics, providers
+    from app.core.workflow import run_discovery_cycle
+    from app.services.reddit import RedditService
+    from app.services.sheets import HEADERS, SheetsService
+
+# Filler words are chosen so none of them hit the default keyword matcher
+FILLER = (
+    "coffee weekend client budget hiring pricing launch product customer meeting "
+    "feedback roadmap design sales market funding office remote contract invoice "
+    "marketing strategy vendor quarter deadline lunch travel partner email support"
+).split()
+PAIN_MARKER = "drowning"
+DRAFT_TEXT = "Same here, we fixed this by putting every update in one place."
+PAIN_PHRASES = [
+    "I am drowning in manual status updates every week",
+    "we are drowning in spreadsheets and nobody knows what is going on",
+    "honestly drowning in follow ups and chasing people for numbers",
+]
+
+# --- Fake Reddit -----------------------------------------------------------
+
+def build_corpus(size: int, subreddits: list, seed: int, relevant_share: float, pain_share: float, repost_share: float) -> list:
+    """Deterministic corpus of Reddit post dicts, newest first."""
+    rng = random.Random(seed)
+    keywords = settings.KEYWORDS
+    now = int(time.time())
+    posts = []
+    for i in range(size):
+        words = rng.choices(FILLER, k=rng.randint(30, 70))
+        if posts and rng.random() < repost_share:
+            # Cross-post of an earlier (newer) post by someone else: near-duplicate content
+            original = posts[rng.randrange(len(posts))]
+            title, body = original["title"], original["selftext"]
+        else:
+            if rng.random() < relevant_share:
+                words.insert(rng.randrange(len(words)), rng.choice(keywords))
+                if rng.random() < pain_share:
+                    words.insert(rng.randrange(len(words)), rng.choice(PAIN_PHRASES))
+            title, body = " ".join(words[:8]).capitalize(), " ".join(words[8:])
+        subreddit = subreddits[i % len(subreddits)]
+        posts.append({
+            "name": f"t3_{i:x}",
+            "id": f"{i:x}",
+            "subreddit": subreddit,
+            "title": title,
+            "selftext": body,
+            "author": f"bench_user_{i}",
+            "permalink": f"/r/{subreddit}/comments/{i:x}/",
+            "created_utc": now - i,
+            "ups": rng.randint(0, 200),
+            "num_comments": rng.randint(0, 50),
+        })
+    return posts
+
+class FakeRedditServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, corpus: list, latency: float, error_rate: float, retry_after: float, seed: int):
+        super().__init__(("127.0.0.1", 0), FakeRedditHandler)
+        self.corpus = corpus
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        # subreddit set -> (posts, position by fullname), built on first request
+        self.listings = {}
+
+    def listing(self, subreddits: str):
+        key = frozenset(s.lower() for s in subreddits.split("+"))
+        if key not in self.listings:
+            posts = [post for post in self.corpus if post["subreddit"].lower() in key]
+            self.listings[key] = (posts, {post["name"]: i for i, post in enumerate(posts)})
+        return self.listings[key]
+
+class FakeRedditHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        match = re.fullmatch(r"/r/([^/]+)/new\.json", url.path)
+        if not match:
+            return self._send(404, {"error": 404})
+
+        time.sleep(server.latency)
+        if server.rng.random() < server.error_rate:
+            return self._send(429, {"error": 429}, {"retry-after": str(server.retry_after)})
+
+        query = parse_qs(url.query)
+        limit = min(int(query.get("limit", ["25"])[0]), 100)
+        posts, positions = server.listing(match.group(1))
+        start = positions[query["after"][0]] + 1 if "after" in query else 0
+        page = posts[start:start + limit]
+        after = page[-1]["name"] if page and start + limit < len(posts) else None
+        self._send(200, {"kind": "Listing", "data": {
+            "after": after,
+            "children": [{"kind": "t3", "data": post} for post in page],
+        }})
+
+    def _send(self, status: int, body: dict, headers: dict = None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_reddit(port_queue, corpus_args: dict, latency: float, error_rate: float, retry_after: float, seed: int):
+    corpus = build_corpus(seed=seed, **corpus_args)
+    server = FakeRedditServer(corpus, latency, error_rate, retry_after, seed)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+# --- Fake Gemini -----------------------------------------------------------
+
+class ResourceExhausted(Exception):
+    """Same class name as google.api_core's 429 error, so is_quota_error() treats it as quota."""
+
+class FakeGeminiModel:
+    """Answers analysis / draft prompts from the post text after a sampled delay."""
+    def __init__(self, latency_ms: float, sigma: float, quota_error_rate: float, seed: int):
+        self.median = latency_ms / 1000.0
+        self.sigma = sigma
+        self.quota_error_rate = quota_error_rate
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+
+    async def generate_content_async(self, prompt: str, **kwargs):
+        if '"outreach_message"' in prompt:
+            kind = "analyze_draft_batch"
+        elif "Posts (JSON array):" in prompt:
+            kind = "analyze_batch"
+        elif "Post Content:" in prompt:
+            kind = "analyze"
+        else:
+            kind = "draft"
+        self.calls[kind] += 1
+
+        await asyncio.sleep(self.rng.lognormvariate(math.log(self.median), self.sigma) if self.median > 0 else 0)
+        if self.rng.random() < self.quota_error_rate:
+            raise ResourceExhausted("429 Resource has been exhausted (e.g. check quota).")
+
+        if kind in ("analyze_batch", "analyze_draft_batch"):
+            posts = json.loads(re.search(r"Posts \(JSON array\):\s*(\[.*\])\s*Return", prompt, re.DOTALL).group(1))
+            items = [{"lead_id": post["lead_id"], **self._analysis(post["post"])} for post in posts]
+            if kind == "analyze_draft_batch":
+                for item in items:
+                    qualified = item["has_pain"] and item["urgency_score"] >= settings.MIN_URGENCY_SCORE
+                    item["outreach_message"] = DRAFT_TEXT if qualified else None
+            text = json.dumps(items)
+        elif kind == "analyze":
+            post = re.search(r"Post Content:\s*(.*?)\s*Return strictly", prompt, re.DOTALL).group(1)
+            text = json.dumps(self._analysis(post))
+        else:
+            text = DRAFT_TEXT
+        return SimpleNamespace(text=text)
+
+    @staticmethod
+    def _analysis(post: str) -> dict:
+        if PAIN_MARKER not in post:
+            return {"has_pain": False, "pain_category": None, "pain_summary": None, "urgency_score": 1, "reasoning": "No pain"}
+        # Stable per post, about half clear the urgency bar
+        urgency = 8 if sum(map(ord, post)) % 2 else 4
+        return {
+            "has_pain": True,
+            "pain_category": "Chasing updates",
+            "pain_summary": "Spends the week chasing status updates.",
+            "urgency_score": urgency,
+            "reasoning": "Explicit frustration",
+        }
+
+# --- In-memory Sheets ------------------------------------------------------
+
+class InMemoryWorksheet:
+    """The subset of the gspread Worksheet API SheetsService uses, kept in a list."""
+    id = 0
+    spreadsheet = SimpleNamespace(id="benchmark")
+
+    def __init__(self, latency: float = 0.0):
+        self.rows = [list(HEADERS)]
+        self.latency = latency
+        self.calls = Counter()
+
+    def _call(self, name: str):
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def row_values(self, row: int) -> list:
+        self._call("row_values")
+        return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def col_values(self, col: int) -> list:
+        self._call("col_values")
+        return [row[col - 1] for row in self.rows]
+
+    def append_row(self, row: list, **kwargs):
+        self._call("append_row")
+        self.rows.append([str(v) if v is not None else "" for v in row])
+
+    def append_rows(self, rows: list, **kwargs):
+        self._call("append_rows")
+        self.rows.extend([str(v) if v is not None else "" for v in row] for row in rows)
+
+    def batch_get(self, ranges: list) -> list:
+        self._call("batch_get")
+        return [self._range(a1) for a1 in ranges]
+
+    def _range(self, a1: str) -> list:
+        if re.fullmatch(r"\d+:\d+", a1):
+            row = int(a1.split(":")[0])
+            return [self.rows[row - 1]] if row <= len(self.rows) else []
+        col, row = re.match(r"([A-Z]+)(\d+)", a1).groups()
+        index = sum((ord(c) - 64) * 26 ** i for i, c in enumerate(reversed(col))) - 1
+        values = [[r[index]] if index < len(r) else [] for r in self.rows[int(row) - 1:]]
+        return values if ":" in a1 else values[:1]
+
+def sheets_factory(worksheet: InMemoryWorksheet):
+    class BenchSheets(SheetsService):
+        def _connect(self):
+            self.sheet = worksheet
+    return BenchSheets
+
+def reddit_factory(base_url: str):
+    class BenchReddit(RedditService):
+        def __init__(self):
+            super().__init__()
+            self.base_url = base_url
+    return BenchReddit
+
+# --- Runner ----------------------------------------------------------------
+
+# Subprocesses run from here, whatever directory the benchmark was started from
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=REPO_DIR).stdout.strip()
+    except Exception:
+        return "unknown"
+
+# Heavy SDKs that should stay out of a cold start
+HEAVY_MODULES = ["google.generativeai", "gspread", "oauth2client", "twikit", "linkedin_api", "httpx"]
+
+STARTUP_SCRIPT = f"""
+import json, sys, time
+started = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - started
+print(json.dumps({{"import_s": elapsed, "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+def measure_startup(repeats: int) -> dict:
+    """Import app.main in fresh interpreters (nothing shared, like a container start)."""
+    env = {**os.environ, "GEMINI_API_KEY": "bench", "GOOGLE_SERVICE_ACCOUNT_JSON": "bench.json"}
+    samples, loaded = [], []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], capture_output=True, text=True, env=env, check=True, cwd=REPO_DIR)
+        sample = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(sample["import_s"])
+        loaded = sample["loaded"]
+    return {"import_s_median": round(statistics.median(samples), 3), "import_s_max": round(max(samples), 3), "heavy_modules_loaded": loaded}
+
+def start_reddit_server(size: int, args) -> tuple:
+    port_queue = multiprocessing.Queue()
+    corpus_args = {
+        "size": size,
+        "subreddits": settings.SUBREDDITS,
+        "relevant_share": args.relevant_share,
+        "pain_share": args.pain_share,
+        "repost_share": args.repost_share,
+    }
+    process = multiprocessing.Process(
+        target=serve_reddit,
+        args=(port_queue, corpus_args, args.reddit_latency_ms / 1000.0, args.reddit_429_rate, args.reddit_retry_after, args.seed),
+        daemon=True
+    )
+    process.start()
+    return process, f"http://127.0.0.1:{port_queue.get(timeout=120)}"
+
+async def run_size(size: int, args) -> dict:
+    process, base_url = start_reddit_server(size, args)
+    try:
+        # Fresh local state, with cursors older than the whole corpus so every post is "new"
+        settings.DATA_DIR = tempfile.mkdtemp(prefix=f"opspilot-bench-{size}-")
+        with open(os.path.join(settings.DATA_DIR, "reddit_cursors.json"), "w") as f:
+            json.dump({s: {"fullname": "t3_seed", "created_utc": 0} for s in settings.SUBREDDITS}, f)
+        settings.REDDIT_MAX_PAGES = math.ceil(size / 100) + 1
+        settings.REDDIT_REQUESTS_PER_SECOND = args.reddit_rps
+        settings.GEMINI_REQUESTS_PER_MINUTE = args.gemini_rpm
+        settings.GEMINI_ANALYSIS_MODE = args.analysis_mode
+        settings.GEMINI_CYCLE_REQUEST_BUDGET = args.cycle_request_budget
+        settings.GEMINI_DAILY_REQUEST_BUDGET = args.daily_request_budget
+        settings.SOURCE_FETCH_TIMEOUT_SECONDS = 3600
+
+        for metric in metrics.registry.metrics.values():
+            metric.values.clear()
+        model = FakeGeminiModel(args.gemini_latency_ms, args.gemini_sigma, args.gemini_quota_rate, args.seed)
+        worksheet = InMemoryWorksheet(args.sheets_latency_ms / 1000.0)
+
+        stage_samples = defaultdict(list)
+        observe = metrics.STAGE_SECONDS.observe
+        def record(value, **labels):
+            stage_samples[labels["stage"]].append(value)
+            observe(value, **labels)
+
+        # Long-lived providers: start from scratch, with the stand-ins injected
+        providers.reset()
+        providers.instances["reddit"] = reddit_factory(base_url)()
+        providers.instances["sheets"] = sheets_factory(worksheet)(providers.get("lead_store"))
+
+        with patch('app.core.providers.enabled_sources', return_value=["reddit"]), \
+             patch('google.generativeai.GenerativeModel', return_value=model), \
+             patch.object(metrics.STAGE_SECONDS, 'observe', record):
+            if args.memory:
+                tracemalloc.start()
+            started = time.perf_counter()
+            result = await run_discovery_cycle()
+            cycle_s = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1] if args.memory else None
+            if args.memory:
+                tracemalloc.stop()
+    finally:
+        process.terminate()
+        process.join()
+        if "lead_store" in providers.instances:
+            providers.instances["lead_store"].close()
+        providers.reset()
+
+    llm_calls = sum(model.calls.values())
+    return {
+        "posts": size,
+        "analysis_mode": result["analysis_mode"],
+        "cycle_s": round(cycle_s, 3),
+        "posts_per_s": round(size / cycle_s, 1),
+        "fetched": result["sources"]["reddit"]["fetched"],
+        "counts": {k: result[k] for k in ("saved", "dupes", "near_dupes", "low_relevance", "low_quality", "deferred")},
+        "llm_calls": dict(model.calls),
+        "llm_calls_per_saved_lead": round(llm_calls / result["saved"], 3) if result["saved"] else None,
+        "quota_errors": metrics.GEMINI_QUOTA_ERRORS.get(),
+        "sheet_rows": len(worksheet.rows) - 1,
+        "sheet_calls": dict(worksheet.calls),
+        "stages_ms": {
+            stage: {
+                "count": len(samples),
+                "p50": round(percentile(samples, 0.5) * 1000, 3),
+                "p95": round(percentile(samples, 0.95) * 1000, 3),
+                "p99": round(percentile(samples, 0.99) * 1000, 3),
+            }
+            for stage, samples in stage_samples.items()
+        },
+        "peak_memory_mb": round(peak / 2 ** 20, 2) if peak is not None else None,
+    }
+
+def print_result(r: dict):
+    print(f"\n=== {r['posts']} posts ({r['analysis_mode']}): {r['cycle_s']}s ({r['posts_per_s']} posts/s), peak memory {r['peak_memory_mb']} MB")
+    print(f"    fetched {r['fetched']}, {r['counts']}")
+    print(f"    LLM calls {r['llm_calls']} -> {r['llm_calls_per_saved_lead']} per saved lead, quota errors {r['quota_errors']}")
+    print(f"    sheet rows {r['sheet_rows']} in {r['sheet_calls']}")
+    print(f"    {'stage':<10} {'count':>8} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for stage, s in r["stages_ms"].items():
+        print(f"    {stage:<10} {s['count']:>8} {s['p50']:>10} {s['p95']:>10} {s['p99']:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the discovery cycle")
+    parser.add_argument("--sizes", default="100,1000,10000,100000", help="Comma separated corpus sizes (posts)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--relevant-share", type=float, default=0.3, help="Posts containing a keyword")
+    parser.add_argument("--pain-share", type=float, default=0.2, help="Relevant posts with a pain statement")
+    parser.add_argument("--repost-share", type=float, default=0.02, help="Posts copying an earlier post")
+    parser.add_argument("--reddit-latency-ms", type=float, default=20)
+    parser.add_argument("--reddit-429-rate", type=float, default=0.01)
+    parser.add_argument("--reddit-retry-after", type=float, default=0.5, help="Seconds sent in Retry-After on a 429")
+    parser.add_argument("--reddit-rps", type=float, default=1000, help="Client-side Reddit rate limit")
+    parser.add_argument("--gemini-latency-ms", type=float, default=50, help="Median of the lognormal latency")
+    parser.add_argument("--gemini-sigma", type=float, default=0.5, help="Lognormal sigma (tail heaviness)")
+    parser.add_argument("--gemini-quota-rate", type=float, default=0.0, help="Share of calls failing with a 429")
+    parser.add_argument("--gemini-rpm", type=float, default=600000, help="Client-side Gemini requests per minute")
+    parser.add_argument("--analysis-mode", choices=["two_call", "fused"], default=settings.GEMINI_ANALYSIS_MODE)
+    parser.add_argument("--cycle-request-budget", type=int, default=0, help="Gemini requests per cycle, 0 = unlimited")
+    parser.add_argument("--daily-request-budget", type=int, default=0, help="Gemini requests per day, 0 = unlimited")
+    parser.add_argument("--sheets-latency-ms", type=float, default=0)
+    parser.add_argument("--startup-repeats", type=int, default=5, help="Cold imports of app.main to time, 0 = skip")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="Skip tracemalloc (it slows the cycle)")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    # The fake server is local, never route it through a proxy
+    os.environ["NO_PROXY"] = ",".join(filter(None, [os.environ.get("NO_PROXY"), "127.0.0.1", "localhost"]))
+
+    startup = None
+    if args.startup_repeats:
+        startup = measure_startup(args.startup_repeats)
+        print(f"=== cold start: import app.main {startup['import_s_median']}s median ({startup['import_s_max']}s max), "
+              f"heavy SDKs loaded: {startup['heavy_modules_loaded'] or 'none'}")
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        result = asyncio.run(run_size(size, args))
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"commit": git_commit(), "args": vars(args), "startup": startup, "results": results}, f, indent=2)
+        print(f"\nWrote {args.json}")
+
+if __name__ == "__main__":
+    main()